@@ -0,0 +1,40 @@
+from MaskVolume import MaskVolume, assign_masked
+
+
+class BrushStroke(object):
+    # One drag of the brush. Mouse samples are queued by add() and applied together by flush(), the first value
+    # of every voxel the stroke touches is kept so the whole stroke is a single change in the history.
+    def __init__(self, action, data):
+        self.action = action
+        self.data = data
+        self.samples = []
+        self.last = None
+        self.touched = MaskVolume(data.shape)
+        self.before = MaskVolume(data.shape)
+
+    def add(self, point):
+        if point != (self.samples[-1] if self.samples else self.last):
+            self.samples.append(point)
+
+    def flush(self, apply):
+        # apply(points) edits the data along the points and returns the change dict of that edit,
+        # the bounding box of the voxels it changed is returned for redrawing
+        if not self.samples:
+            return None
+        points = self.samples if self.last is None else [self.last] + self.samples
+        self.last = self.samples[-1]
+        self.samples = []
+        change = apply(points)
+        if change is None or change["region"] is None:
+            return None
+        region, mask = change["region"], change["mask"]
+        first = mask & (self.touched[region] == 0)
+        assign_masked(self.before, region, first, change["data"][0][first[mask]])
+        assign_masked(self.touched, region, first, 1)
+        return change["bbox"]
+
+    def change(self):
+        if self.touched.bbox is None:
+            return None
+        mask = self.touched.data > 0
+        return {"action": self.action, "region": self.touched.bbox, "mask": mask, "data": [self.before.data[mask]]}
@@ -1,23 +1,30 @@
 import os
 import sys
-import vtkmodules.all as vtk
 import numpy as np
 import time
 from PyQt5 import QtCore
-from PyQt5.QtWidgets import QApplication, QMainWindow, QFileDialog, QFileDialog, QGraphicsBlurEffect
+from PyQt5.QtWidgets import QApplication, QMainWindow, QFileDialog, QFileDialog, QGraphicsBlurEffect, QInputDialog
 import pyqtgraph as pg
-import SimpleITK as sitk
-from vtk.util import numpy_support
 
 from CT_readerUI3 import UI_CTReaderWindow
-from VTK_showerUI import UI_VTKshower
 from Calculator import Calculator
+from History import ChangeHistory
+from BrushStroke import BrushStroke
+from LabelMap import LabelMap
+from Workers import ComputeJob
+from DicomLoader import DicomSeriesLoader
+from VolumeCache import VolumeCache, default_cache_dir
+from ThresholdPreview import ThresholdPreview
+from SliceCache import SliceCache, slice_view, display_rect, slice_region
+from Exporters import EXPORTERS
+from Profiler import span
 
 class CTReaderApp(QMainWindow):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.gui = UI_CTReaderWindow()
         self.calculator = Calculator()
+        self.volume_cache = None
         self.setup_ui()
     
     def setup_ui(self):
@@ -26,11 +33,24 @@ class CTReaderApp(QMainWindow):
         # Load data buttons
         self.gui.loadBinaryButton.clicked.connect(self.load_binary_file)
         self.gui.loadDicomButton.clicked.connect(self.load_dicom_file)
+        self.gui.cancel_load_button.clicked.connect(self.cancel_loading)
+        # Decoded series are cached on disk unless turned off, the folder and its size are kept between sessions
+        self.settings = QtCore.QSettings('CT-Annotator', 'CT_reader6')
+        self.cache_dir = self.settings.value('cache/dir', default_cache_dir(), type=str)
+        self.gui.cache_checkbox.setChecked(self.settings.value('cache/enabled', True, type=bool))
+        self.gui.cache_budget.setValue(self.settings.value('cache/max_gb', 4, type=int))
+        self.gui.cache_checkbox.stateChanged.connect(self.cache_settings_changed)
+        self.gui.cache_budget.valueChanged.connect(self.cache_settings_changed)
+        self.gui.cache_folder_button.clicked.connect(self.choose_cache_folder)
+        self.cache_settings_changed()
 
         # View functions
         self.gui.axial_view.stateChanged.connect(self.axial_clicked)
         self.gui.sagittal_view.stateChanged.connect(self.sagittal_clicked)
         self.gui.coronal_view.stateChanged.connect(self.coronal_clicked)
+        self.gui.tri_planar_view.stateChanged.connect(self.tri_planar_clicked)
+        self.gui.tri_view.sigCursorMoved.connect(self.cursor_moved)
+        self.gui.performance_view.stateChanged.connect(self.performance_clicked)
 
         # Cropping, ROI and Threshold buttons/sliders 
         self.gui.z_slider.valueChanged.connect(self.update_slice)
@@ -40,42 +60,70 @@ class CTReaderApp(QMainWindow):
         self.gui.axial_rect.sigRegionChangeFinished.connect(self.update_slider_from_rect)
         self.gui.confirm_roi_button.clicked.connect(self.confirm_roi)
         self.gui.threshold_slider.valueChanged.connect(self.update_threshold)
+        # Slider ticks only restart the timer, the preview slice is drawn once the events have settled
+        self.threshold_timer = QtCore.QTimer(self)
+        self.threshold_timer.setSingleShot(True)
+        self.threshold_timer.setInterval(30)
+        self.threshold_timer.timeout.connect(self.update_slice)
         self.gui.confirm_thresh_button.clicked.connect(self.confirm_threshold)
+        self.gui.cancel_thresh_button.clicked.connect(self.cancel_threshold)
 
         # Editing buttons/sliders
         self.gui.edit_slider.valueChanged.connect(self.edit_size)
         self.gui.edit_checkbox.stateChanged.connect(self.edit_checked)
         self.gui.multiple_slices.stateChanged.connect(self.multiple_slices_checked)
+        self.gui.round_brush.stateChanged.connect(self.round_brush_checked)
         self.gui.erase_button.clicked.connect(self.erase_clicked)
         self.gui.draw_button.clicked.connect(self.draw_clicked)
         self.gui.grow_button.clicked.connect(self.grow_clicked)
         self.gui.undo_button.clicked.connect(self.undo)
+        self.gui.redo_button.clicked.connect(self.redo)
+        self.gui.history_budget.valueChanged.connect(self.history_budget_changed)
+        # Drawing and erasing follow left-button drags on the slice, mouse samples are applied once per frame
+        self.gui.image_view.scene.installEventFilter(self)
+        self.stroke_timer = QtCore.QTimer(self)
+        self.stroke_timer.setInterval(16)
+        self.stroke_timer.timeout.connect(self.paint_stroke)
        
         # Storing, saving and resetting buttons
         self.gui.store_button.clicked.connect(self.store_file)
         self.gui.reset_button.clicked.connect(self.reset_images)
         self.gui.clear_button.clicked.connect(self.clear_images)
 
+        for key, exporter in EXPORTERS.items():
+            self.gui.export_format.addItem(exporter.name, key)
         self.gui.create_final_button.clicked.connect(self.create_final_image)
         self.gui.view_3d.clicked.connect(self.view_3d)
 
         self.axial = 1
         self.sagittal = 0
         self.coronal = 0
+        self.tri_planar = 0
         self.step = 0
         self.saved = 0
         self.overlay = 0
         self.checked = 0
         self.mult_sliced_checked = 0
+        self.brush_shape = 'cube'
 
         self.erase_enabled = False
         self.draw_enabled = False
         self.grow_enabled = False
         self.original_image = None
+        self.loader_job = None
+        self.threshold_job = None
+        self.export_jobs = []
+        self.mesh_job = None
+        self.threshold_preview = None
+        self.preview_job = None
+        self.slice_cache = None
+        self.last_slice_index = 0
+        self.displayed_step = None
+        self.stroke = None
         
-        self.change_history = []
-        self.change_history2 = []
+        self.history = ChangeHistory(self.gui.history_budget.value() * 1024 * 1024)
         self.binary_images = []
+        self.label_map = None
         
         self.filter_volume = None 
         self.first_image_loaded = None
@@ -89,10 +137,93 @@ class CTReaderApp(QMainWindow):
 
     # Loading files
     def load_data(self, data_type, data_path):
-        data = self.dicom_reader(data_path)
+        # Headers only, to let the user pick a series when the folder holds several. Both the scan and the
+        # load run on a worker thread so the window stays responsive, on large folders the scan takes a while too
+        loader = DicomSeriesLoader(data_path, cache=self.volume_cache)
+        self.start_loader_job(ComputeJob(loader.scan, on_cancel=loader.cancel), data_path,
+                              lambda series: self.choose_series(data_type, data_path, loader, series))
+
+    def choose_series(self, data_type, data_path, loader, series):
+        if not series:
+            self.stop_loading(f"No DICOM images found in {data_path}")
+            return
+        series_instance_uid = None
+        if len(series) > 1:
+            series.sort(key=lambda info: info['slices'], reverse=True)
+            items = [f"{info['series_description'] or info['series_instance_uid']} ({info['modality']}, {info['slices']} slices)" for info in series]
+            item, ok = QInputDialog.getItem(self, "Choose Series", "Series:", items, 0, False)
+            if not ok:
+                self.stop_loading(f"Loading cancelled: {data_path}")
+                return
+            series_instance_uid = series[items.index(item)]['series_instance_uid']
+
+        self.start_loader_job(ComputeJob(loader.load, series_instance_uid=series_instance_uid, on_cancel=loader.cancel), data_path,
+                              lambda result: self.finish_loading(data_type, data_path, *result))
+
+    def start_loader_job(self, job, data_path, finished):
+        self.loader_job = job
+        self.loader_job.signals.progress.connect(self.load_progress)
+        self.loader_job.signals.finished.connect(finished)
+        self.loader_job.signals.cancelled.connect(lambda: self.stop_loading(f"Loading cancelled: {data_path}"))
+        self.loader_job.signals.failed.connect(lambda error: self.stop_loading(f"Loading failed: {error}"))
+
+        self.gui.loadBinaryButton.setDisabled(True)
+        self.gui.loadDicomButton.setDisabled(True)
+        self.gui.load_progress.setValue(0)
+        self.gui.load_progress.show()
+        self.gui.cancel_load_button.show()
+        self.loader_job.start()
+
+    def cache_settings_changed(self):
+        enabled = self.gui.cache_checkbox.isChecked()
+        max_bytes = self.gui.cache_budget.value() * 1024 ** 3
+        self.gui.cache_budget.setEnabled(enabled)
+        self.gui.cache_folder_button.setEnabled(enabled)
+        self.settings.setValue('cache/enabled', enabled)
+        self.settings.setValue('cache/max_gb', self.gui.cache_budget.value())
+        if not enabled:
+            self.volume_cache = None
+            return
+        if self.volume_cache is None or self.volume_cache.cache_dir != self.cache_dir:
+            self.volume_cache = VolumeCache(self.cache_dir, max_bytes)
+        used = self.volume_cache.set_max_bytes(max_bytes)
+        self.gui.cache_checkbox.setToolTip(f"{self.cache_dir}: {used / (1024 * 1024):.0f} MB used")
+
+    def choose_cache_folder(self):
+        cache_dir = QFileDialog.getExistingDirectory(self, "Choose Cache Folder", self.cache_dir)
+        if cache_dir:
+            self.cache_dir = cache_dir
+            self.settings.setValue('cache/dir', cache_dir)
+            self.cache_settings_changed()
+
+    def load_progress(self, done, total, stage=''):
+        self.gui.load_progress.setMaximum(total)
+        self.gui.load_progress.setValue(done)
+        self.gui.load_progress.setFormat(f"{stage or 'Decoding slices'} (%p%)")
+
+    def cancel_loading(self):
+        if self.loader_job is not None:
+            self.loader_job.cancel()
+
+    def stop_loading(self, message):
+        print(message)
+        self.gui.load_progress.hide()
+        self.gui.cancel_load_button.hide()
+        if self.original_image is None:
+            self.gui.loadBinaryButton.setEnabled(True)
+            self.gui.loadDicomButton.setEnabled(True)
+
+    def finish_loading(self, data_type, data_path, data, metadata):
+        self.gui.load_progress.hide()
+        self.gui.cancel_load_button.hide()
         print(f"{data_type} file loaded: {data_path}")
 
         if data_type == "DICOM":
+            self.image_position_patient = metadata['image_position_patient']
+            self.pixel_spacing = metadata['pixel_spacing']
+            self.image_orientation = metadata['image_orientation']
+            self.slice_thickness = metadata['slice_thickness']
+
             file_name = os.path.basename(data_path)
             self.gui.view_label.setText(file_name)
 
@@ -103,7 +234,8 @@ class CTReaderApp(QMainWindow):
             self.gui.y_cropping_slider.setRange(0, data.shape[1]-1)
             self.gui.z_cropping_slider.setRange(0, data.shape[2]-1)
 
-            self.original_image = data.copy()
+            self.original_image = data
+            self.threshold_preview = ThresholdPreview(data, None)
             self.gui.axial_view.setChecked(True)
             self.gui.confirm_roi_button.setEnabled(True)
             self.gui.loadBinaryButton.setDisabled(True)
@@ -113,8 +245,10 @@ class CTReaderApp(QMainWindow):
             self.update_slice()
         
         elif data_type == 'Binary':
-            data = self.dicom_reader(data_path)
             self.binary_images.append(data)
+            if self.original_image is None:
+                self.gui.loadBinaryButton.setEnabled(True)
+                self.gui.loadDicomButton.setEnabled(True)
 
     def load_binary_file(self):
         options = QFileDialog.Options()
@@ -128,68 +262,87 @@ class CTReaderApp(QMainWindow):
         if dir_path:
             self.load_data("DICOM", dir_path)
     
-    def dicom_reader(self, data_path):
-        reader = vtk.vtkDICOMImageReader()
-        reader.SetDirectoryName(data_path)
-        reader.Update()
-
-        _extent = reader.GetDataExtent()
-        ConstPixelDims = [_extent[1]-_extent[0]+1, _extent[3]-_extent[2]+1, _extent[5]-_extent[4]+1]
-        imageData = reader.GetOutput()
-        pointData = imageData.GetPointData()
-        assert (pointData.GetNumberOfArrays()==1)
-        arrayData = pointData.GetArray(0)
-
-        ArrayDicom = numpy_support.vtk_to_numpy(arrayData)
-        ArrayDicom = ArrayDicom.reshape(ConstPixelDims, order='F')
-        data = ArrayDicom[:, ::-1, ::-1]
-
-        self.image_position_patient = reader.GetImagePositionPatient()
-        self.pixel_spacing = reader.GetPixelSpacing()
-        self.image_orientation = reader.GetImageOrientationPatient()
+    # View handling function
+    def update_slice(self):
+        if self.original_image is not None:
+            with span('CTReaderApp.update_slice', 'render'):
+                z = self.gui.z_slider.value()
+                self.gui.z_slider_label.setText(str(z))
+
+                if self.tri_planar:
+                    self.update_tri_view(z)
+                elif self.axial or self.sagittal or self.coronal:
+                    if self.slice_cache is None or self.slice_cache.volume is not self.original_image:
+                        self.reset_slice_cache()
+                    orientation = self.displayed_orientation()
+                    image_slice = self.slice_cache.get(orientation, z)
+                    self.slice_cache.prefetch(orientation, z, z - self.last_slice_index)
+                    self.last_slice_index = z
+
+                    if self.step == 0:
+                        self.current_slice = image_slice
+                    elif self.step == 1:
+                        self.current_slice = self.threshold_preview.mask_slice(image_slice, self.lower_threshold, self.upper_threshold)
+                    elif self.step == 2:
+                        # Composite the overlay for the displayed slice only
+                        self.current_slice = self.calculator.composite_slice(image_slice, slice_view(self.filter_volume, orientation, z))
+                    image_item = self.gui.image_view.getImageItem()
+                    window_level, window_width = image_item.getLevels()
+
+                    self.handle_slice_display(window_level, window_width)
+
+    def update_tri_view(self, z):
+        # The slider moves the axial slice, the other two panes follow the crosshair
+        tri_view = self.gui.tri_view
+        if tri_view.volume is not self.original_image:
+            tri_view.set_volume(self.original_image, self.gui.image_view.getImageItem().getLevels() if self.step == 0 else None)
+        mask = self.filter_volume if self.step == 2 else None
+        if tri_view.mask is not mask:
+            tri_view.set_mask(mask)
+        x, y, _ = tri_view.cursor
+        tri_view.set_cursor(x, y, z)
+
+    def tri_planar_clicked(self, state):
+        if state == QtCore.Qt.Checked:
+            self.tri_planar = 1
+            self.gui.image_view.hide()
+            self.gui.tri_view.show()
+            if self.original_image is not None:
+                self.gui.z_slider.setRange(0, self.original_image.shape[2] - 1)
+        else:
+            self.tri_planar = 0
+            self.gui.tri_view.hide()
+            self.gui.image_view.show()
+            if self.original_image is not None:
+                axis = 2 if self.axial else 1 if self.sagittal else 0
+                self.gui.z_slider.setRange(0, self.original_image.shape[axis] - 1)
+        self.update_slice()
 
-        dicom_files = [os.path.join(data_path, f) for f in os.listdir(data_path)]
+    def performance_clicked(self, state):
+        self.gui.profiler_panel.setVisible(state == QtCore.Qt.Checked)
 
-        ds = sitk.ReadImage(dicom_files[0])
-        self.slice_thickness = float(ds.GetMetaData('0018|0050'))
+    def cursor_moved(self, x, y, z):
+        self.gui.z_slider.setValue(z)
 
-        return data
+    def displayed_orientation(self):
+        return 'axial' if self.axial else 'sagittal' if self.sagittal else 'coronal'
 
-    # View handling function
-    def update_slice(self):
-        if self.original_image is not None:
-            z = self.gui.z_slider.value()
-            self.gui.z_slider_label.setText(str(z))
-
-            if self.axial or self.sagittal or self.coronal:
-                if self.step == 0:
-                    if self.axial:
-                        self.current_slice = self.original_image[:, :, z]
-                    elif self.sagittal:
-                        self.current_slice = self.original_image[:, z, :][:, ::-1] 
-                    elif self.coronal:
-                        self.current_slice = self.original_image[z, :, :][:, ::-1] 
-                elif self.step == 1:
-                    if self.axial:
-                        self.current_slice = self.original_image[:, :, z]
-                    elif self.sagittal:
-                        self.current_slice = self.original_image[:,  z, :][:, ::-1] 
-                    elif self.coronal:
-                        self.current_slice = self.original_image[z, :, :][:, ::-1] 
-                    self.current_slice = np.where((self.current_slice >= self.lower_threshold) & (self.current_slice <= self.upper_threshold), 1, 0)
-                elif self.step == 2:
-                    if self.axial:
-                        self.current_slice = self.overlayed_image[:, :, z]
-                    elif self.sagittal:
-                        self.current_slice = self.overlayed_image[:, z, :][:, ::-1] 
-                    elif self.coronal:
-                        self.current_slice = self.overlayed_image[z, :, :][:, ::-1] 
-                image_item = self.gui.image_view.getImageItem()
-                window_level, window_width = image_item.getLevels()
-
-                self.handle_slice_display(window_level, window_width)
+    def reset_slice_cache(self):
+        if self.slice_cache is not None:
+            self.slice_cache.close()
+        self.slice_cache = SliceCache(self.original_image)
+        self.last_slice_index = 0
 
     def handle_slice_display(self, window_level, window_width):
+        image_item = self.gui.image_view.getImageItem()
+        same_display = (image_item.image is not None and image_item.image.shape == self.current_slice.shape
+                        and self.displayed_step == self.step and not (self.step == 2 and self.overlay == 0))
+        self.displayed_step = self.step
+        if self.first_image_loaded is not None and same_display:
+            # Swap the pixels of the existing item, levels, histogram range and view stay as they are
+            image_item.updateImage(self.current_slice, autoLevels=False)
+            return
+
         if self.first_image_loaded is None:
             self.first_image_loaded = True
             self.gui.image_view.setImage(self.current_slice)
@@ -300,6 +453,14 @@ class CTReaderApp(QMainWindow):
         print(f'X Range: {self.x_min_ROI} - {self.x_max_ROI}')
         print(f'Y Range: {self.y_min_ROI} - {self.y_max_ROI}')
         print(f'Z Range: {self.z_min_ROI} - {self.z_max_ROI}')
+
+        # Per-slice histograms of the ROI, built in the background for the in-range voxel count
+        roi = (slice(self.x_min_ROI, self.x_max_ROI), slice(self.y_min_ROI, self.y_max_ROI), slice(self.z_min_ROI, self.z_max_ROI))
+        self.threshold_preview = ThresholdPreview(self.original_image, roi)
+        self.preview_job = ComputeJob(self.threshold_preview.build)
+        self.preview_job.signals.finished.connect(self.update_threshold_count)
+        self.preview_job.signals.failed.connect(lambda error: print(f"Threshold histogram failed: {error}"))
+        self.preview_job.start()
         self.gui.confirm_thresh_button.setEnabled(True)
         self.gui.confirm_roi_button.setDisabled(True)
         self.gui.step3_frame.setGraphicsEffect(None)
@@ -313,16 +474,66 @@ class CTReaderApp(QMainWindow):
         self.lower_threshold = thresh_value[0]
         self.upper_threshold = thresh_value[1]
         self.step = 1
-        self.update_slice()
+        self.update_threshold_count()
+        self.threshold_timer.start()
+
+    def update_threshold_count(self, *args):
+        preview = self.threshold_preview
+        if preview is None or not preview.ready or self.step != 1:
+            return
+        count = preview.count(self.lower_threshold, self.upper_threshold)
+        total = int(preview.cumulative[:, -1].sum())
+        self.gui.threshold_count_label.setText(f"ROI voxels in range: {count} ({100 * count / max(total, 1):.1f}%)")
     
     def confirm_threshold(self):
-        self.filter_volume, self.overlayed_image = self.calculator.confrim_threshold(self.original_image, self.x_min_ROI, self.x_max_ROI, self.y_min_ROI, self.y_max_ROI, self.z_min_ROI, self.z_max_ROI, self.lower_threshold, self.upper_threshold, self.saved)
+        # 0 keeps the default of 3 components, 7 once a structure has been stored
+        k = self.gui.components_k.value() or None
+        min_size = self.gui.components_min_size.value()
+        connectivity = int(self.gui.components_connectivity.currentText())
+
+        # The filters run on the thread pool, the viewer stays interactive meanwhile
+        self.threshold_job = ComputeJob(self.calculator.confrim_threshold, self.original_image, self.x_min_ROI, self.x_max_ROI, self.y_min_ROI, self.y_max_ROI, self.z_min_ROI, self.z_max_ROI, self.lower_threshold, self.upper_threshold, self.saved, k, min_size, connectivity, max_workers=os.cpu_count())
+        self.threshold_job.signals.progress.connect(self.threshold_progress)
+        self.threshold_job.signals.finished.connect(self.finish_threshold)
+        self.threshold_job.signals.cancelled.connect(lambda: self.stop_threshold("Thresholding cancelled"))
+        self.threshold_job.signals.failed.connect(lambda error: self.stop_threshold(f"Thresholding failed: {error}"))
+
+        self.gui.confirm_thresh_button.setDisabled(True)
+        self.gui.threshold_slider.setDisabled(True)
+        self.gui.threshold_progress.setValue(0)
+        self.gui.threshold_progress.show()
+        self.gui.cancel_thresh_button.show()
+        self.threshold_job.start()
+
+    def threshold_progress(self, done, total, stage):
+        self.gui.threshold_progress.setMaximum(total)
+        self.gui.threshold_progress.setValue(done)
+        self.gui.threshold_progress.setFormat(f"{stage} (%p%)")
+
+    def cancel_threshold(self):
+        if self.threshold_job is not None:
+            self.threshold_job.cancel()
+
+    def stop_threshold(self, message):
+        print(message)
+        self.threshold_job = None
+        self.gui.threshold_progress.hide()
+        self.gui.cancel_thresh_button.hide()
+        self.gui.confirm_thresh_button.setEnabled(True)
+        self.gui.threshold_slider.setEnabled(True)
+
+    def finish_threshold(self, filter_volume):
+        self.threshold_job = None
+        self.gui.threshold_progress.hide()
+        self.gui.cancel_thresh_button.hide()
+        self.gui.threshold_slider.setEnabled(True)
+        self.filter_volume = filter_volume
         self.step = 2
         self.gui.draw_button.setEnabled(True)
         self.gui.erase_button.setEnabled(True)
         self.gui.grow_button.setEnabled(True)
         self.gui.undo_button.setEnabled(True)
-        self.gui.confirm_thresh_button.setDisabled(True)
+        self.gui.redo_button.setEnabled(True)
         self.gui.store_button.setEnabled(True)
         self.gui.step4_frame.setGraphicsEffect(None)
         self.gui.step3_frame.setGraphicsEffect(QGraphicsBlurEffect())
@@ -364,8 +575,6 @@ class CTReaderApp(QMainWindow):
             self.gui.draw_button.setText('Draw')
             self.gui.grow_button.setText('Grow From Seeds')
             self.disconnect_mouse_click()
-            self.mouse_click_callback = lambda event, array1=self.overlayed_image, array2=self.filter_volume: self.eraseordrawMouseClicked(event, array1, array2, self.lower_threshold, self.upper_threshold)
-            self.gui.image_view.scene.sigMouseClicked.connect(self.mouse_click_callback)
         else:
             self.gui.erase_button.setText('Erase')
             
@@ -378,8 +587,6 @@ class CTReaderApp(QMainWindow):
             self.gui.erase_button.setText('Erase')
             self.gui.grow_button.setText('Grow From Seeds')
             self.disconnect_mouse_click()
-            self.mouse_click_callback = lambda event, array1=self.overlayed_image, array2=self.filter_volume: self.eraseordrawMouseClicked(event, array1, array2, self.lower_threshold, self.upper_threshold)
-            self.gui.image_view.scene.sigMouseClicked.connect(self.mouse_click_callback)
         else:
             self.gui.draw_button.setText('Draw')
     
@@ -392,7 +599,7 @@ class CTReaderApp(QMainWindow):
             self.gui.erase_button.setText('Erase')
             self.gui.draw_button.setText('Draw')
             self.disconnect_mouse_click()
-            self.mouse_click_callback = lambda event, array1=self.overlayed_image, array2=self.filter_volume: self.grow_seed(event, array1, array2, self.lower_threshold, self.upper_threshold)
+            self.mouse_click_callback = lambda event, array=self.filter_volume: self.grow_seed(event, array, self.lower_threshold, self.upper_threshold)
             self.gui.image_view.scene.sigMouseClicked.connect(self.mouse_click_callback)
         else:
             self.gui.grow_button.setText('Grow From Seeds')
@@ -400,6 +607,7 @@ class CTReaderApp(QMainWindow):
     def disconnect_mouse_click(self):
         if hasattr(self, 'mouse_click_callback'):
             self.gui.image_view.scene.sigMouseClicked.disconnect(self.mouse_click_callback)
+            del self.mouse_click_callback
 
     def edit_checked(self, state):
         if state == QtCore.Qt.Checked:
@@ -412,60 +620,133 @@ class CTReaderApp(QMainWindow):
             self.mult_sliced_checked = 1
         else:
             self.mult_sliced_checked = 0
-            
-    def eraseordrawMouseClicked(self, event, data, data2, threshold_min, threshold_max):
-        x, y = event.scenePos().x(), event.scenePos().y()
-        x_index, y_index, z_index = self.get_indices_based_on_plane(x, y)
-        size = self.gui.edit_slider.value()
 
-        if (size) <= x_index < (data[1].shape[0] - size) and (size) <= y_index < (data[1].shape[0] - size):
-            change, change2 = self.calculator.erase_or_draw(size, x_index, y_index, z_index, data, data2, threshold_min, threshold_max, self.erase_enabled, self.draw_enabled, self.original_image, self.axial, self.sagittal, self.coronal, self.checked, self.mult_sliced_checked)
-            self.change_history.append(change)
-            self.change_history2.append(change2)
-            self.update_slice()
+    def round_brush_checked(self, state):
+        if state == QtCore.Qt.Checked:
+            self.brush_shape = 'sphere'
         else:
-            print("Click in range")
+            self.brush_shape = 'cube'
+
+    def eventFilter(self, obj, event):
+        if obj is self.gui.image_view.scene and (self.erase_enabled or self.draw_enabled) and self.filter_volume is not None and not self.tri_planar:
+            # Consumed so the view does not pan while painting
+            if event.type() == QtCore.QEvent.GraphicsSceneMousePress and event.button() == QtCore.Qt.LeftButton:
+                self.start_stroke(event.scenePos())
+                return True
+            elif event.type() == QtCore.QEvent.GraphicsSceneMouseMove and self.stroke is not None:
+                self.extend_stroke(event.scenePos())
+                return True
+            elif event.type() == QtCore.QEvent.GraphicsSceneMouseRelease and event.button() == QtCore.Qt.LeftButton and self.stroke is not None:
+                self.extend_stroke(event.scenePos())
+                self.finish_stroke()
+                return True
+        return super().eventFilter(obj, event)
+
+    def stroke_point(self, scene_pos):
+        x_index, y_index, z_index = self.get_indices_based_on_plane(scene_pos.x(), scene_pos.y())
+        size = self.gui.edit_slider.value()
+        shape = self.filter_volume.shape
+        if (size) <= x_index < (shape[0] - size) and (size) <= y_index < (shape[1] - size) and 0 <= z_index < shape[2]:
+            return x_index, y_index, z_index
+        return None
 
-    def grow_seed(self, event, data, data2, threshold_min, threshold_max):
+    def start_stroke(self, scene_pos):
+        point = self.stroke_point(scene_pos)
+        if point is None:
+            print("Click in range")
+            return
+        self.stroke = BrushStroke("erase" if self.erase_enabled else "draw", self.filter_volume)
+        self.stroke.add(point)
+        self.paint_stroke()
+        self.stroke_timer.start()
+
+    def extend_stroke(self, scene_pos):
+        point = self.stroke_point(scene_pos)
+        if point is not None:
+            self.stroke.add(point)
+
+    def paint_stroke(self):
+        # Every sample since the last frame is applied as one edit and only its part of the slice is redrawn
+        if self.stroke is None:
+            return
+        size = self.gui.edit_slider.value()
+        region = self.stroke.flush(lambda points: self.calculator.erase_or_draw_stroke(
+            size, points, self.stroke.data, self.lower_threshold, self.upper_threshold, self.erase_enabled, self.draw_enabled,
+            self.original_image, self.axial, self.sagittal, self.coronal, self.checked, self.mult_sliced_checked, self.brush_shape))
+        if region is not None:
+            self.repaint_region(region)
+
+    def finish_stroke(self):
+        self.stroke_timer.stop()
+        self.paint_stroke()
+        self.history.push(self.stroke.change(), [self.stroke.data])
+        self.stroke = None
+        self.update_history_label()
+
+    def repaint_region(self, region):
+        # Redraws what an edit of the mask inside region changed on screen. The composited slice is patched in
+        # place, levels, histogram and view stay as they are.
+        if region is None:
+            return
+        if self.tri_planar:
+            self.gui.tri_view.redraw_overlays(region)
+            return
+        image_item = self.gui.image_view.getImageItem()
+        orientation = self.displayed_orientation()
+        z = self.gui.z_slider.value()
+        rect = display_rect(self.original_image.shape, orientation, z, region)
+        if rect is None:
+            return
+        if self.step != 2 or self.displayed_step != 2 or image_item.image is None or image_item.image.ndim != 3:
+            self.update_slice()
+            return
+        with span('CTReaderApp.repaint_region', 'render'):
+            image = image_item.image
+            image[rect] = self.calculator.composite_slice(slice_region(self.original_image, orientation, z, region),
+                                                          slice_region(self.filter_volume, orientation, z, region))
+            image_item.blockSignals(True)
+            image_item.updateImage(image, autoLevels=False)
+            image_item.blockSignals(False)
+
+    def grow_seed(self, event, data, threshold_min, threshold_max):
         x, y = event.scenePos().x(), event.scenePos().y()
         x_index, y_index, z_index = self.get_indices_based_on_plane(x, y)
-        change, change2 = self.calculator.grow_from_seeds(x_index, y_index, z_index, self.original_image, data, data2, threshold_min, threshold_max)
+        connectivity = int(self.gui.grow_connectivity.currentText())
+        max_voxels = self.gui.grow_limit.value()
+        change = self.calculator.grow_from_seeds(x_index, y_index, z_index, self.original_image, data, threshold_min, threshold_max, connectivity, max_voxels)
 
-        self.change_history.append(change)
-        self.change_history2.append(change2)
+        self.history.push(change, [data])
+        self.update_history_label()
         print('Finished Growing Seed')
-        self.update_slice()
+        self.repaint_region(change["bbox"])
 
     def undo(self):
-        if self.change_history:
+        if len(self.history):
             self.gui.draw_button.setText('Draw')
             self.gui.erase_button.setText('Erase')
             self.gui.grow_button.setText('Grow From Seeds')
-            last_change = self.change_history.pop()
-            last_change2 = self.change_history2.pop()
-
-            original_data = last_change["data"]
-            original_data2 = last_change2["data"]
-            action = last_change["action"]
-
-            # Update the original data back to the data array
-            if action == 'erase' or action =='draw':
-                x_index = last_change["x_index"]
-                y_index = last_change["y_index"]
-                z_index = last_change["z_index"]
-                x_index = last_change2["x_index"]
-                y_index = last_change2["y_index"]
-                z_index = last_change2["z_index"]
-                self.overlayed_image[x_index - 8:x_index + 8, y_index - 8: y_index + 8, z_index-8: z_index+8] = original_data
-                self.filter_volume[x_index - 8:x_index + 8, y_index - 8: y_index + 8, z_index-8: z_index+8] = original_data2
-            elif action == 'grow':
-                self.overlayed_image = original_data
-                self.filter_volume = original_data2
-            self.update_slice()
+            # Restore the previous values of the changed voxels
+            delta = self.history.undo([self.filter_volume])
+            self.update_history_label()
+            self.repaint_region(delta.region)
+
+    def redo(self):
+        delta = self.history.redo([self.filter_volume])
+        if delta is not None:
+            self.update_history_label()
+            self.repaint_region(delta.region)
+
+    def history_budget_changed(self):
+        self.history.set_max_bytes(self.gui.history_budget.value() * 1024 * 1024)
+        self.update_history_label()
+
+    def update_history_label(self):
+        self.gui.history_label.setText(f"History: {len(self.history)} edits, {self.history.nbytes / (1024 * 1024):.2f} MB")
 
     # Store image in memory 
     def store_file(self):
-        self.binary_images.append(self.filter_volume)
+        self.binary_images.append(self.filter_volume.shrink())
+        self.current_label_map()
         # self.new_window(self.filter_volume)
         self.saved = 1
         self.reset_images()
@@ -475,90 +756,79 @@ class CTReaderApp(QMainWindow):
         print("Stored Progress")
 
     def create_final_image(self):
-        max_z_dim = self.original_image.shape[2]
-        combined_bin_image = np.zeros(self.original_image.shape, dtype=np.int64)
-
-        for image in self.binary_images:
-            # print(image.shape[2])
-            if image.shape[2] != max_z_dim:
-                print('Not the same shape')
-                padded_image = np.zeros(self.original_image.shape, dtype=np.int64)
-                padded_image[:, :, :image.shape[2]] = image
-                combined_bin_image += padded_image
-            else:
-                scale_factor = 100
-                scaled_image = (image * scale_factor).astype(np.int64)
-                combined_bin_image += scaled_image
-
-        self.convert_to_original_coordinates(combined_bin_image)
+        # The export runs in the background, it gets its own copy while new structures can still be stored
+        self.convert_to_original_coordinates(self.current_label_map().data.copy())
         print("Saved Full Binary File")
         # self.new_window(combined_bin_image)
         self.reset_images()
     
     def view_3d(self):
+        # VTK is imported the first time a 3D view is opened, it was most of the start-up time
         if len(self.binary_images) != 0:
-            max_z_dim = self.original_image.shape[2]
-            combined_bin_image = np.zeros(self.original_image.shape, dtype=np.int64)
-
-            for image in self.binary_images:
-                if image.shape[2] != max_z_dim:
-                    padded_image = np.zeros(self.original_image.shape, dtype=np.int64)
-                    padded_image[:, :, :image.shape[2]] = image
-                    combined_bin_image += padded_image
-                else:
-                    scale_factor = 100
-                    scaled_image = (image * scale_factor).astype(np.int64)
-                    combined_bin_image += scaled_image
-            self.new_window(combined_bin_image)
-    
+            label_map = self.current_label_map()
+            if not self.gui.mesh_mode.isChecked():
+                self.new_window(label_map.data)
+            elif label_map.bbox is not None:
+                # Surface extraction, decimation and smoothing run on the thread pool
+                spacing = list(self.pixel_spacing)
+                if len(spacing) < 3:
+                    spacing.append(self.slice_thickness)
+                from MeshBuilder import build_mesh, crop_to_bbox
+                self.gui.view_3d.setDisabled(True)
+                # The job gets its own copy of the structures, storing one changes the label map in place
+                region, start = crop_to_bbox(label_map.data, label_map.bbox)
+                self.mesh_job = ComputeJob(build_mesh, region, start, spacing[:3])
+                self.mesh_job.signals.finished.connect(self.show_mesh)
+                self.mesh_job.signals.failed.connect(lambda error: self.stop_mesh(f"3D view failed: {error}"))
+                self.mesh_job.start()
+
+    def show_mesh(self, mesh):
+        from VTK_showerUI import UI_VTKshower
+        self.stop_mesh(f"Showing 3D mesh with {mesh.GetNumberOfPolys()} triangles")
+        self.second_window = UI_VTKshower()
+        self.second_window.render_surface(mesh)
+        self.second_window.show()
+
+    def stop_mesh(self, message):
+        print(message)
+        self.mesh_job = None
+        self.gui.view_3d.setEnabled(True)
+
+    def current_label_map(self):
+        # Binary files can be loaded before the DICOM series, they are added once its shape is known
+        if self.label_map is None or self.label_map.shape != self.original_image.shape:
+            self.label_map = LabelMap(self.original_image.shape)
+        return self.label_map.sync(self.binary_images)
+
     # Create a new window to display 3D
     def new_window(self, array):
+            import vtkmodules.all as vtk
+            from vtk.util import numpy_support
+            from VTK_showerUI import UI_VTKshower
+
         # Create numpy data
-            start_time = time.time()
-            numpydata = array
-            numpydata = numpydata.astype("float")
-            numpydata = np.transpose(array, axes=(0, 2, 1))
-            dimension = numpydata.shape
-            step1 = time.time() - start_time
-            print(f'Transposing array {step1}')
+            with span('CTReaderApp.new_window.transpose', '3d'):
+                numpydata = np.transpose(array, axes=(0, 2, 1))
+                dimension = numpydata.shape
 
             # Copy to vtk
-            vtkarr = numpy_support.numpy_to_vtk(numpydata.flatten(), deep=True, array_type=vtk.VTK_FLOAT)
-            origin = [0,0,0]
-            spacing = [0.5,1,0.5]
-            image_data = vtk.vtkImageData()
-            image_data.SetDimensions(dimension[0], dimension[1], dimension[2])
-            image_data.SetOrigin(origin[0],origin[1],origin[2])
-            image_data.SetSpacing(spacing[0], spacing[1], spacing[2])
-            image_data.GetPointData().SetScalars(vtkarr)
-
-            step2 = time.time() - start_time - step1
-            print(f'Converting to vtk data {step2}')
-
-            self.second_window = UI_VTKshower()
-            self.second_window.render_mesh(image_data)
-            self.second_window.show()
-            step3 = time.time() - start_time - step2 - step1
-            print(f'Showing 3D {step3}')
+            with span('CTReaderApp.new_window.to_vtk', '3d'):
+                vtkarr = numpy_support.numpy_to_vtk(numpydata.flatten(), deep=True, array_type=vtk.VTK_FLOAT)
+                origin = [0,0,0]
+                spacing = [0.5,1,0.5]
+                image_data = vtk.vtkImageData()
+                image_data.SetDimensions(dimension[0], dimension[1], dimension[2])
+                image_data.SetOrigin(origin[0],origin[1],origin[2])
+                image_data.SetSpacing(spacing[0], spacing[1], spacing[2])
+                image_data.GetPointData().SetScalars(vtkarr)
+
+            with span('CTReaderApp.new_window.show', '3d'):
+                self.second_window = UI_VTKshower()
+                self.second_window.render_mesh(image_data)
+                self.second_window.show()
     
     def convert_to_original_coordinates(self, array):
-        spacing = self.pixel_spacing
-        origin = self.image_position_patient
-       
-        series_uid = "A" 
-        study_uid = 'B'
-        array = array[::-1, :, :]
-        array = np.rot90(array, k=-1, axes=(0, 1))
-        array = np.transpose(array, axes=(2, 0, 1))
-        # array = np.transpose(array[::-1, :, :], axes=(1, 2, 0))
-        thickness = self.slice_thickness
-
-        # Create a single SimpleITK image for the entire 3D volume
-        new_img = sitk.GetImageFromArray(array)
-        # new_img.SetPixelIDValue(sitk.sitkFloat32) 
-        new_img.SetSpacing([spacing[0], spacing[1], thickness])
-        new_img.SetOrigin((origin[0], origin[1], origin[2]))
-
+        exporter = EXPORTERS[self.gui.export_format.currentData()]
         options = QFileDialog.Options()
         output_dir = QFileDialog.getExistingDirectory(None, "Save DICOM Files", "", options=options)    
 
@@ -566,54 +836,42 @@ class CTReaderApp(QMainWindow):
             print("No output directory selected. Exiting.")
             return
 
-        # Create a subdirectory named "DICOM_{date}" within the selected directory
+        # Create a subdirectory named "DICOM_{date}" within the selected directory, or a single file for the other formats
         date_str = time.strftime("%Y%m%d")
-        subdirectory = os.path.join(output_dir, f"{self.gui.view_label.text()}_{date_str}")
-
-        if not os.path.exists(subdirectory):
-            os.makedirs(subdirectory)
-
-        writer = sitk.ImageFileWriter()
-        writer.KeepOriginalImageUIDOn()
-
-        for i in range(self.original_image.shape[2]):
-            # Get the current 2D slice from the 3D volume
-            image_slice = new_img[:, :, i]
-            image_slice = sitk.Cast(image_slice, sitk.sitkUInt16)
-
-            # Set metadata for each slice
-            image_slice.SetMetaData("0010|0010", "Output Patient")
-            image_slice.SetMetaData("0010|0020", "CT_vessl")
-            image_slice.SetMetaData("0020|000d", study_uid)
-            image_slice.SetMetaData("0020|000e", series_uid)
-            image_slice.SetMetaData("0008|0020", time.strftime("%Y%m%d"))
-            image_slice.SetMetaData("0008|0030", time.strftime("%H%M%S"))
-            image_slice.SetMetaData("0018|0088", str(thickness))
-            image_slice.SetMetaData("0018|9306", str(thickness))
-            image_slice.SetMetaData("0028|0030", f"{spacing[0]}\\{spacing[1]}")
-            image_position = f"{origin[0]}\\{origin[1]}\\{origin[2] + i*thickness}"
-            image_slice.SetMetaData("0020|0032", image_position)
-            image_slice.SetMetaData("0018|0050", str(thickness))
-            image_slice.SetMetaData("0018|103e", 'CoW')
-            image_slice.SetMetaData("0020|0052", series_uid)
-            image_slice.SetMetaData("0008|0012", time.strftime("%Y%m%d"))
-            image_slice.SetMetaData("0008|0013", time.strftime("%H%M%S"))
-            image_slice.SetMetaData("0008|0060", "CT")
-            # image_slice.SetMetaData("0020|0032", "\\".join(map(str, new_img.TransformIndexToPhysicalPoint((-125, -125, i)))))
-            image_slice.SetMetaData("0020|0037", "1.000000\\0.000000\\0.000000\\0.000000\\1.000000\\0.000000")
-            image_slice.SetMetaData("0020|0013", str(i))
-
-            filename = os.path.join(subdirectory, f"{str(i)}.dcm")
-            
-            writer.SetFileName(filename)
-            writer.Execute(image_slice)
-        
-        print(f"DICOM files saved in: {subdirectory}")
+        path = exporter.output_path(output_dir, f"{self.gui.view_label.text()}_{date_str}")
+        metadata = {
+            'pixel_spacing': self.pixel_spacing,
+            'image_position_patient': self.image_position_patient,
+            'image_orientation': self.image_orientation,
+            'slice_thickness': self.slice_thickness,
+        }
+
+        # Writing and compressing run on the thread pool, the combined volume is not shared with the viewer
+        job = ComputeJob(exporter.export, array, path, metadata)
+        job.signals.progress.connect(self.export_progress)
+        job.signals.finished.connect(lambda path: self.finish_export(job, f"Saved: {path}"))
+        job.signals.failed.connect(lambda error: self.finish_export(job, f"Saving failed: {error}"))
+        self.export_jobs.append(job)
+        self.gui.export_progress.setValue(0)
+        self.gui.export_progress.show()
+        job.start()
+
+    def export_progress(self, done, total, stage):
+        self.gui.export_progress.setMaximum(total)
+        self.gui.export_progress.setValue(done)
+        self.gui.export_progress.setFormat(f"{stage} (%p%)")
+
+    def finish_export(self, job, message):
+        print(message)
+        self.export_jobs.remove(job)
+        if not self.export_jobs:
+            self.gui.export_progress.hide()
 
     def reset_images(self):
         if self.original_image is not None:
             self.filter_volume  = None
-            self.change_history = [] 
+            self.history.clear()
+            self.update_history_label()
             self.step = 0
             self.overlay = 0
             self.gui.image_view.setLevels(-2048, 3071)
@@ -623,6 +881,7 @@ class CTReaderApp(QMainWindow):
             self.gui.draw_button.setDisabled(True)
             self.gui.grow_button.setDisabled(True)
             self.gui.undo_button.setDisabled(True)
+            self.gui.redo_button.setDisabled(True)
             self.gui.store_button.setDisabled(True)
             self.gui.loadBinaryButton.setDisabled(True)
             self.gui.loadDicomButton.setDisabled(True)
@@ -638,6 +897,7 @@ class CTReaderApp(QMainWindow):
         self.saved = 0
         self.original_image = None
         self.binary_images = []
+        self.label_map = None
         self.gui.loadBinaryButton.setEnabled(True)
         self.gui.loadDicomButton.setEnabled(True)
         self.gui.confirm_roi_button.setDisabled(True)
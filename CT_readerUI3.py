@@ -4,6 +4,9 @@ import pyqtgraph as pg
 from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import QGraphicsBlurEffect, QScrollArea
 
+from TriPlanarView import TriPlanarView
+from ProfilerPanel import ProfilerPanel
+
 class UI_CTReaderWindow(object):
     def setupUI(self, CTReaderWindow):
         CTReaderWindow.setObjectName("CTReaderWindow")
@@ -28,6 +31,10 @@ class UI_CTReaderWindow(object):
         self.image_view = pg.ImageView(self.centralwidget)
         self.image_view.getView().addItem(self.axial_rect)
 
+        # Axial, sagittal and coronal panes with a linked crosshair, shown instead of the single view
+        self.tri_view = TriPlanarView(self.centralwidget)
+        self.tri_view.hide()
+
         # Z slider to change view of image 
         self.z_slider = QtWidgets.QSlider(Qt.Horizontal,self.centralwidget)
         self.z_slider.setGeometry(10, 670, 600, 20)
@@ -53,6 +60,32 @@ class UI_CTReaderWindow(object):
         self.step1_frame_layout.addWidget(self.loadBinaryButton)
         self.step1_frame_layout.addWidget(self.loadDicomButton)
 
+        # Progress of the series being loaded
+        load_progress_layout = QtWidgets.QHBoxLayout()
+        self.load_progress = QtWidgets.QProgressBar(self.step1_frame)
+        self.load_progress.hide()
+        load_progress_layout.addWidget(self.load_progress, 3)
+
+        self.cancel_load_button = QtWidgets.QPushButton('Cancel', self.step1_frame)
+        self.cancel_load_button.hide()
+        load_progress_layout.addWidget(self.cancel_load_button, 1)
+        self.step1_frame_layout.addLayout(load_progress_layout)
+
+        # Disk cache of the decoded series
+        cache_layout = QtWidgets.QHBoxLayout()
+        self.cache_checkbox = QtWidgets.QCheckBox('Disk cache', self.step1_frame)
+        cache_layout.addWidget(self.cache_checkbox, 1)
+
+        self.cache_budget = QtWidgets.QSpinBox(self.step1_frame)
+        self.cache_budget.setRange(1, 1024)
+        self.cache_budget.setValue(4)
+        self.cache_budget.setSuffix(' GB')
+        cache_layout.addWidget(self.cache_budget, 1)
+
+        self.cache_folder_button = QtWidgets.QPushButton('Cache Folder...', self.step1_frame)
+        cache_layout.addWidget(self.cache_folder_button, 1)
+        self.step1_frame_layout.addLayout(cache_layout)
+
         self.layout1.addWidget(self.step1_frame)
     
 
@@ -116,13 +149,44 @@ class UI_CTReaderWindow(object):
         self.threshold_slider.setRange(0, 1000)
         self.step3_frame_layout.addWidget(self.threshold_slider)
         self.step3_frame_layout.addWidget(self.threshold_label)
+        self.threshold_count_label = QtWidgets.QLabel('ROI voxels in range: -', self.step3_frame)
+        self.step3_frame_layout.addWidget(self.threshold_count_label)
         
+        # Number of components kept, their minimum size and connectivity
+        components_layout = QtWidgets.QHBoxLayout()
+        self.components_k = QtWidgets.QSpinBox(self.step3_frame)
+        self.components_k.setRange(0, 100)
+        self.components_k.setSpecialValueText('Keep: Auto')
+        self.components_k.setPrefix('Keep: ')
+        components_layout.addWidget(self.components_k, 1)
+
+        self.components_min_size = QtWidgets.QSpinBox(self.step3_frame)
+        self.components_min_size.setRange(0, 10000000)
+        self.components_min_size.setSingleStep(100)
+        self.components_min_size.setPrefix('Min size: ')
+        components_layout.addWidget(self.components_min_size, 1)
+
+        self.components_connectivity = QtWidgets.QComboBox(self.step3_frame)
+        self.components_connectivity.addItems(['6', '26'])
+        components_layout.addWidget(self.components_connectivity, 1)
+        self.step3_frame_layout.addLayout(components_layout)
+
         # Create a QPushButton for confirming the threshold
         self.confirm_thresh_button = QtWidgets.QPushButton('Confirm Threshold', self.step3_frame)
         self.confirm_thresh_button.setText('Confirm Threshold')
         self.confirm_thresh_button.setDisabled(True)
         self.step3_frame_layout.addWidget(self.confirm_thresh_button)
 
+        threshold_progress_layout = QtWidgets.QHBoxLayout()
+        self.threshold_progress = QtWidgets.QProgressBar(self.step3_frame)
+        self.threshold_progress.hide()
+        threshold_progress_layout.addWidget(self.threshold_progress, 3)
+
+        self.cancel_thresh_button = QtWidgets.QPushButton('Cancel', self.step3_frame)
+        self.cancel_thresh_button.hide()
+        threshold_progress_layout.addWidget(self.cancel_thresh_button, 1)
+        self.step3_frame_layout.addLayout(threshold_progress_layout)
+
         self.step3_frame.setGraphicsEffect(QGraphicsBlurEffect())
         self.layout3.addWidget(self.step3_frame)
 
@@ -154,6 +218,9 @@ class UI_CTReaderWindow(object):
         self.edit_checkbox = QtWidgets.QCheckBox('Threshold', self.step4_frame)
         checkbox_layout.addWidget(self.edit_checkbox, 1)
 
+        self.round_brush = QtWidgets.QCheckBox('Round', self.step4_frame)
+        checkbox_layout.addWidget(self.round_brush, 1)
+
         self.step4_frame_layout.addLayout(checkbox_layout)
        
         # Create a QPushButton for erasing tool
@@ -172,11 +239,43 @@ class UI_CTReaderWindow(object):
         self.step4_frame_layout.addWidget(self.grow_button)
         self.grow_button.setDisabled(True)
 
-        # Create a QPushButton for undo tool
+        # Connectivity and voxel limit for growing
+        grow_layout = QtWidgets.QHBoxLayout()
+        self.grow_connectivity = QtWidgets.QComboBox(self.step4_frame)
+        self.grow_connectivity.addItems(['6', '18', '26'])
+        grow_layout.addWidget(self.grow_connectivity, 1)
+
+        self.grow_limit = QtWidgets.QSpinBox(self.step4_frame)
+        self.grow_limit.setRange(1000, 100000000)
+        self.grow_limit.setSingleStep(100000)
+        self.grow_limit.setValue(5000000)
+        self.grow_limit.setPrefix('Max voxels: ')
+        grow_layout.addWidget(self.grow_limit, 2)
+        self.step4_frame_layout.addLayout(grow_layout)
+
+        # Create QPushButtons for undo and redo tools
+        history_layout = QtWidgets.QHBoxLayout()
         self.undo_button = QtWidgets.QPushButton('Undo', self.step4_frame)
-        self.step4_frame_layout.addWidget(self.undo_button)
+        history_layout.addWidget(self.undo_button)
         self.undo_button.setDisabled(True)
 
+        self.redo_button = QtWidgets.QPushButton('Redo', self.step4_frame)
+        history_layout.addWidget(self.redo_button)
+        self.redo_button.setDisabled(True)
+        self.step4_frame_layout.addLayout(history_layout)
+
+        # History memory usage and budget
+        history_info_layout = QtWidgets.QHBoxLayout()
+        self.history_label = QtWidgets.QLabel('History: 0 edits, 0.00 MB', self.step4_frame)
+        history_info_layout.addWidget(self.history_label, 2)
+
+        self.history_budget = QtWidgets.QSpinBox(self.step4_frame)
+        self.history_budget.setRange(16, 16384)
+        self.history_budget.setValue(256)
+        self.history_budget.setSuffix(' MB')
+        history_info_layout.addWidget(self.history_budget, 1)
+        self.step4_frame_layout.addLayout(history_info_layout)
+
         self.step4_frame.setGraphicsEffect(QGraphicsBlurEffect())
         self.layout4.addWidget(self.step4_frame)
 
@@ -219,14 +318,27 @@ class UI_CTReaderWindow(object):
         self.step6_label.setAlignment(QtCore.Qt.AlignCenter)
         self.step6_frame_layout.addWidget(self.step6_label)
 
+        # Format the stored structures are saved in
+        self.export_format = QtWidgets.QComboBox(self.step6_frame)
+        self.step6_frame_layout.addWidget(self.export_format)
+
         # Create a QPushButton for saving file 
         self.create_final_button = QtWidgets.QPushButton('Save', self.step6_frame)
         self.create_final_button.setDisabled(True)
         self.step6_frame_layout.addWidget(self.create_final_button)
 
+        self.export_progress = QtWidgets.QProgressBar(self.step6_frame)
+        self.export_progress.hide()
+        self.step6_frame_layout.addWidget(self.export_progress)
+
         self.view_3d = QtWidgets.QPushButton('View 3D', self.step6_frame)
         self.step6_frame_layout.addWidget(self.view_3d)
 
+        # Surface mesh of the stored structures instead of volume rendering the whole label map
+        self.mesh_mode = QtWidgets.QCheckBox('Mesh', self.step6_frame)
+        self.mesh_mode.setChecked(True)
+        self.step6_frame_layout.addWidget(self.mesh_mode)
+
         # self.step6_frame.setGraphicsEffect(QGraphicsBlurEffect())
         self.layout6.addWidget(self.step6_frame)        
 
@@ -238,15 +350,20 @@ class UI_CTReaderWindow(object):
         self.axial_view = QtWidgets.QCheckBox('Axial View', self.checkboxes_frame)
         self.sagittal_view = QtWidgets.QCheckBox('Sagittal View', self.checkboxes_frame)
         self.coronal_view = QtWidgets.QCheckBox('Coronal View', self.checkboxes_frame)
+        self.tri_planar_view = QtWidgets.QCheckBox('Tri-planar', self.checkboxes_frame)
+        self.performance_view = QtWidgets.QCheckBox('Performance', self.checkboxes_frame)
 
         checkboxes.addWidget(self.view_label, 4)
         checkboxes.addWidget(self.axial_view, 1)
         checkboxes.addWidget(self.sagittal_view, 1)
         checkboxes.addWidget(self.coronal_view, 1)
+        checkboxes.addWidget(self.tri_planar_view, 1)
+        checkboxes.addWidget(self.performance_view, 1)
 
         self.checkboxes_frame.setLayout(checkboxes)
         self.left_column_layout.addWidget(self.checkboxes_frame)
         self.left_column_layout.addWidget(self.image_view)
+        self.left_column_layout.addWidget(self.tri_view)
         self.left_column_layout.addWidget(self.z_slider)
         self.left_column_layout.addWidget(self.z_slider_label)
 
@@ -257,6 +374,12 @@ class UI_CTReaderWindow(object):
         self.right_column_layout.addLayout(self.layout4)
         self.right_column_layout.addLayout(self.layout5)
         self.right_column_layout.addLayout(self.layout6)
+
+        # Timings of loading, thresholding, edits, rendering and export
+        self.profiler_panel = ProfilerPanel(self.right_column_widget)
+        self.profiler_panel.setMinimumHeight(250)
+        self.profiler_panel.hide()
+        self.right_column_layout.addWidget(self.profiler_panel)
         self.right_column_layout.setSpacing(3)
 
         self.main_layout.addLayout(self.left_column_layout, 3)
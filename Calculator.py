@@ -1,12 +1,26 @@
 import numpy as np
-import time
 from scipy import ndimage
 
-from skimage.morphology import disk
+from MaskVolume import MaskVolume, MASK_LEVEL, assign_masked
+from ChunkedPipeline import ChunkedPipeline
+from Profiler import timed
+
+def disk(radius):
+    # Same footprint as skimage.morphology.disk, kept here so importing the calculator only needs NumPy and SciPy
+    x, y = np.ogrid[-radius:radius + 1, -radius:radius + 1]
+    return (x * x + y * y <= radius * radius).astype(np.uint8)
+
 
 class Calculator(object):
-    def confrim_threshold(self, original_image, x_min, x_max, y_min, y_max, z_min, z_max, lower_thresh, higher_thresh, saved):
-        start_time = time.time()
+    smoothing_sigma = 0.4
+
+    @timed(category='threshold')
+    def confrim_threshold(self, original_image, x_min, x_max, y_min, y_max, z_min, z_max, lower_thresh, higher_thresh, saved, k=None, min_size=0, connectivity=6, progress=None, max_workers=1):
+        # progress(done, total, stage) is called before every stage, a background job can stop the pipeline from it
+        if progress is None:
+            progress = lambda done, total, stage: None
+        stages = 6
+
         original_shape = original_image.shape
         crop_info = {
             'x_min_ROI': x_min,
@@ -16,252 +30,275 @@ class Calculator(object):
             'z_min_ROI': z_min,
             'z_max_ROI': z_max,
         }
-        cropped_data = original_image[crop_info['x_min_ROI']:crop_info['x_max_ROI'],
-                                   crop_info['y_min_ROI']:crop_info['y_max_ROI'],
-                                   crop_info['z_min_ROI']:crop_info['z_max_ROI']]
-
-        # Apply thresholding
-        threshold_condition = (cropped_data >= lower_thresh) & (cropped_data <= higher_thresh)
-        data_threshold = np.where(threshold_condition, 1, 0)
+        roi = (slice(crop_info['x_min_ROI'], crop_info['x_max_ROI']),
+               slice(crop_info['y_min_ROI'], crop_info['y_max_ROI']),
+               slice(crop_info['z_min_ROI'], crop_info['z_max_ROI']))
+        cropped_data = original_image[roi]
+
+        if k is None:
+            k = 3 if saved == 0 else 7
+
+        if max_workers is None or max_workers > 1:
+            # Same mask as the serial stages below, computed in z-chunks on a thread pool
+            levels = ChunkedPipeline(self, max_workers).run(cropped_data, lower_thresh, higher_thresh, k, min_size, connectivity, progress)
+            filtered_image = MaskVolume(original_shape, roi, levels)
+        else:
+            # Apply thresholding
+            progress(0, stages, 'Thresholding')
+            data_threshold = self.threshold_roi(cropped_data, lower_thresh, higher_thresh)
+            print('Confirmed threshold')
+
+            progress(1, stages, 'Opening and closing')
+            processed_slices = self.open_close(data_threshold)
+            progress(2, stages, 'Connected components')
+            filtered_data = self.largest_components(processed_slices, k, min_size, connectivity)
+            progress(3, stages, 'Dilating and eroding')
+            new_volume = self.dilate_erode(filtered_data)
+            progress(4, stages, 'Smoothing')
+            new_volume = self.smooth(new_volume)
+
+            # Keep only the ROI box as uint8 levels instead of a full-size float volume
+            progress(5, stages, 'Storing mask')
+            filtered_image = MaskVolume.from_soft(original_shape, roi, new_volume)
+        progress(stages, stages, 'Done')
+        print('Finished applying image transforms')
 
-        step1_time = time.time() - start_time
-        print(f"Step 1 thresholding: {step1_time} seconds")
+        return filtered_image
 
-        print('Confirmed threshold')
-        processed_slices = []
+    @timed(category='threshold')
+    def threshold_roi(self, cropped_data, lower_thresh, higher_thresh):
+        return ((cropped_data >= lower_thresh) & (cropped_data <= higher_thresh)).astype(np.uint8)
 
-        # Define the structuring element and number of iterations
-        structure = np.ones((3, 3), dtype=bool)  # 3x3 square structuring element
+    @timed(category='threshold')
+    def open_close(self, data_threshold):
+        # 3x3 square structuring element, flat along z so every slice is processed on its own
+        structure = np.ones((3, 3, 1), dtype=bool)
         iterations = 1
 
-        processed_slices = np.empty_like(data_threshold)
-
-        # Perform binary opening and closing on each slice
-        for z in range(data_threshold.shape[2]):
-            z_slice = data_threshold[:, :, z]
-
-            opened_image = ndimage.binary_opening(z_slice, structure=structure, iterations=iterations)
-            closed_image = ndimage.binary_closing(opened_image, structure=structure, iterations=iterations)
-
-            processed_slices[:, :, z] = closed_image.astype(np.uint8)
-
-        # Stack the processed slices along the third axis
-        processed_slices
-
-        step2_time = time.time() - step1_time - start_time
-        print(f"Step 2 opening and closing: {step2_time} seconds")
+        opened_image = ndimage.binary_opening(data_threshold, structure=structure, iterations=iterations)
+        closed_image = ndimage.binary_closing(opened_image, structure=structure, iterations=iterations)
+        return closed_image.astype(np.uint8)
 
+    @timed(category='threshold')
+    def largest_components(self, processed_slices, k=3, min_size=0, connectivity=6):
         # Label connected components in the binary image
-        labeled_image, num_features = ndimage.label(processed_slices)
-        component_sizes = ndimage.sum(data_threshold, labeled_image, range(1, num_features + 1))
-        if saved == 0:
-            largest_components_indices = np.argsort(component_sizes)[-3:]
-        else:
-            print("Conncect Components")
-            largest_components_indices = np.argsort(component_sizes)[-7:]
-
-        # Create masks for the selected number of largest components
-        component_masks = [labeled_image == idx + 1 for idx in largest_components_indices]
-        filtered_data = np.zeros_like(labeled_image, dtype=np.uint8)
-        for mask in component_masks:
-            filtered_data += mask
-        
-        step3_time = time.time() - step2_time - step1_time - start_time
-        print(f"Step 3 connected components: {step3_time} seconds")
-
+        structure = ndimage.generate_binary_structure(3, {6: 1, 26: 3}[connectivity])
+        labeled_image, num_features = ndimage.label(processed_slices, structure=structure)
+
+        # Keep the k largest components of at least min_size voxels through a label lookup table
+        component_sizes = np.bincount(labeled_image.ravel(), minlength=num_features + 1)
+        component_sizes[0] = 0
+        largest_labels = np.argsort(component_sizes, kind='stable')[::-1][:k]
+        keep = largest_labels[component_sizes[largest_labels] >= max(min_size, 1)]
+        lookup = np.zeros(num_features + 1, dtype=np.uint8)
+        lookup[keep] = 1
+        return lookup[labeled_image]
+
+    @timed(category='threshold')
+    def dilate_erode(self, filtered_data):
+        # disk(3) in-plane, flat along z
         radius = 3
-        structure = disk(radius)
+        structure = disk(radius)[:, :, np.newaxis]
         iterations = 1
 
-        new_slices = []
-        for z in range(filtered_data.shape[2]):
-            z_slice = filtered_data[:, :, z]  # Extract the current Z-slice
-
-            dilated_image = ndimage.binary_dilation(z_slice, structure=structure, iterations=iterations)
-            # Perform binary erosion
-            eroded_image = ndimage.binary_erosion(dilated_image, structure=structure, iterations=iterations)
-            eroded_image = eroded_image.astype(np.uint8)
-
-            new_slices.append(eroded_image)
-        
-        step4_time = time.time() - step3_time - step2_time - step1_time - start_time
-        print(f"Step 4 dilating and eroding: {step4_time} seconds")
-
-        new_volume = np.stack(new_slices, axis=2)
-        new_volume = ndimage.gaussian_filter(new_volume.astype(float), sigma=0.4)
-        step5_time = time.time() - step4_time - step3_time - step2_time - step1_time - start_time
-        print(f"Step 5 Gaussian: {step5_time} seconds")
-
-        restored_data = np.zeros(original_shape)
-        restored_data[crop_info['x_min_ROI']:crop_info['x_max_ROI'],
-                    crop_info['y_min_ROI']:crop_info['y_max_ROI'],
-                    crop_info['z_min_ROI']:crop_info['z_max_ROI']] = new_volume
-
-
-        filtered_image = restored_data.copy()
-        print('Finished applying image transforms')
-
-        orig_rgb = np.stack((original_image, original_image, original_image), axis=-1)
-        bin_image = filtered_image
-        bin_rgb = np.zeros((bin_image.shape[0], bin_image.shape[1], bin_image.shape[2], 3), dtype=np.uint8)
-        bin_rgb[..., 1] = bin_image * 255  # Set the red channel to the binary image 
-        mask = bin_rgb > 0
-        orig_rgb[mask] = bin_rgb[mask]
-        overlayed_image = orig_rgb
-        
-        
-        step6_time = time.time() - step5_time - step4_time - step3_time - step2_time - step1_time - start_time
-        print(f"Step 6 Overlaying: {step6_time} seconds")
-        total_time = time.time() - start_time
-        print(f"Total time: {total_time} seconds")
-
-        return filtered_image, overlayed_image
-    
-    def erase_or_draw(self, size, x_index, y_index, z_index, data, data2, threshold_min, threshold_max, erase_enabled, draw_enabled, original_image, axial, sagittal, coronal, checked, mult_sliced_checked ):
-
-        # Create a copy of the original data before making changes
-        original_data = np.copy(data[x_index-8:x_index+8, y_index - 8: y_index + 8, z_index-8:z_index+8])
-        original_data2 = np.copy(data2[x_index-8:x_index+8, y_index - 8: y_index + 8, z_index-8:z_index+8])
-
-        for x in range(x_index - size + 1, x_index + size ):
-            for y in range(y_index - size + 1, y_index + size):
-                for z in range(z_index - size + 1, z_index + size):
-                    if erase_enabled or draw_enabled:
-                        pixel_value = original_image[x, y, z]
-                        if axial:
-                            if checked == 1:
-                                # draw with threshold
-                                if (threshold_min - 150) <= pixel_value <= (threshold_max + 150):
-                                    if erase_enabled:
-                                        # Erase the data
-                                        if mult_sliced_checked == 1: 
-                                            self.erase_slices(data, data2, x, y, z, original_image)
-                                        else:
-                                            self.erase_slices(data, data2, x, y, z_index, original_image)
-                                    elif draw_enabled:
-                                        # Draw on the data
-                                        if mult_sliced_checked == 1:
-                                            self.paint_slices(data, data2, x, y, z)
-                                        else:
-                                            self.paint_slices(data, data2, x, y, z_index)
-                            else:
-                                if erase_enabled:
-                                    # Erase the data
-                                    if mult_sliced_checked == 1:
-                                        self.erase_slices(data, data2, x, y, z, original_image)
-                                    else:
-                                        self.erase_slices(data, data2, x, y, z_index, original_image)
-                                elif draw_enabled:
-                                    # Draw on the data
-                                    if mult_sliced_checked == 1:
-                                        self.paint_slices(data, data2, x, y, z)
-                                    else:
-                                        self.paint_slices(data, data2, x, y, z_index)
-                        elif sagittal:
-                            if checked == 1:
-                                # draw with threshold
-                                if (threshold_min - 150) <= pixel_value <= (threshold_max + 150):
-                                    if erase_enabled:
-                                        # Erase the data
-                                        if mult_sliced_checked == 1: 
-                                            self.erase_slices(data, data2, x, y, z, original_image)
-                                        else:
-                                            self.erase_slices(data, data2, x, y_index, z, original_image)
-                                    elif draw_enabled:
-                                        # Draw on the data
-                                        if mult_sliced_checked == 1:
-                                            self.paint_slices(data, data2, x, y, z)
-                                        else:
-                                            self.paint_slices(data, data2, x, y_index, z)
-                            else:
-                                if erase_enabled:
-                                    # Erase the data
-                                    if mult_sliced_checked == 1:
-                                        self.erase_slices(data, data2, x, y, z, original_image)
-                                    else:
-                                        self.erase_slices(data, data2, x, y_index, z, original_image)
-                                elif draw_enabled:
-                                    # Draw on the data
-                                    if mult_sliced_checked == 1:
-                                        self.paint_slices(data, data2, x, y, z)
-                                    else:
-                                        self.paint_slices(data, data2, x, y_index, z)
-                        elif coronal:
-                            if checked == 1:
-                                # draw with threshold
-                                if (threshold_min - 150) <= pixel_value <= (threshold_max + 150):
-                                    if erase_enabled:
-                                        # Erase the data
-                                        if mult_sliced_checked == 1: 
-                                            self.erase_slices(data, data2, x, y, z, original_image)
-                                        else:
-                                            self.erase_slices(data, data2, x_index, y, z, original_image)
-                                    elif draw_enabled:
-                                        # Draw on the data
-                                        if mult_sliced_checked == 1:
-                                            self.paint_slices(data, data2, x, y, z)
-                                        else:
-                                            self.paint_slices(data, data2, x_index, y, z)
-                            else:
-                                if erase_enabled:
-                                    # Erase the data
-                                    if mult_sliced_checked == 1:
-                                        self.erase_slices(data, data2, x, y, z, original_image)
-                                    else:
-                                        self.erase_slices(data, data2, x_index, y, z, original_image)
-                                elif draw_enabled:
-                                    # Draw on the data
-                                    if mult_sliced_checked == 1:
-                                        self.paint_slices(data, data2, x, y, z)
-                                    else:
-                                        self.paint_slices(data, data2, x_index, y, z)
-        # Append the change to the history once
-        change = {"action": "erase" if erase_enabled else "draw", "data": original_data, "x_index": x_index, "y_index": y_index, "z_index": z_index}
-        change2 = {"action": "erase" if erase_enabled else "draw", "data": original_data2, "x_index": x_index, "y_index": y_index, "z_index": z_index}
-
-        return change, change2
+        dilated_image = ndimage.binary_dilation(filtered_data, structure=structure, iterations=iterations)
+        eroded_image = ndimage.binary_erosion(dilated_image, structure=structure, iterations=iterations)
+        return eroded_image.astype(np.uint8)
+
+    @timed(category='threshold')
+    def smooth(self, new_volume):
+        return ndimage.gaussian_filter(new_volume.astype(float), sigma=self.smoothing_sigma)
+
+    @timed(category='render')
+    def composite_slice(self, image_slice, mask_slice):
+        # Overlay the mask in the green channel of a grayscale slice, only for the displayed slice
+        rgb_slice = np.repeat(image_slice[..., np.newaxis], 3, axis=-1)
+        green = mask_slice if mask_slice.dtype == np.uint8 else (mask_slice * MASK_LEVEL).astype(np.uint8)
+        overlay = green > 0
+        rgb_slice[..., 1][overlay] = green[overlay]
+        return rgb_slice
     
-    def erase_slices(self, array1, array2, x, y, z, original_image):
-        array1[x, y, z] = original_image[x, y, z]
-        array2[x, y, z] = 0
+    @timed(category='edit')
+    def erase_or_draw(self, size, x_index, y_index, z_index, data, threshold_min, threshold_max, erase_enabled, draw_enabled, original_image, axial, sagittal, coronal, checked, mult_sliced_checked, brush_shape='cube'):
+
+        change = {"action": "erase" if erase_enabled else "draw", "region": None, "mask": None, "data": [], "bbox": None}
+        if erase_enabled or draw_enabled:
+            region, mask = self.brush_region(size, x_index, y_index, z_index, original_image.shape, axial, sagittal, coronal, mult_sliced_checked, brush_shape)
+            self.apply_brush(change, region, mask, data, threshold_min, threshold_max, erase_enabled, original_image, checked)
+
+        return change
+
+    @timed(category='edit')
+    def erase_or_draw_stroke(self, size, points, data, threshold_min, threshold_max, erase_enabled, draw_enabled, original_image, axial, sagittal, coronal, checked, mult_sliced_checked, brush_shape='cube'):
+        # Same edit as erase_or_draw at every voxel of the path through points, applied in one go
+        change = {"action": "erase" if erase_enabled else "draw", "region": None, "mask": None, "data": [], "bbox": None}
+        if (erase_enabled or draw_enabled) and len(points):
+            region, mask = self.stroke_region(size, self.stroke_path(points), original_image.shape, axial, sagittal, coronal, mult_sliced_checked, brush_shape)
+            self.apply_brush(change, region, mask, data, threshold_min, threshold_max, erase_enabled, original_image, checked)
+
+        return change
+
+    def apply_brush(self, change, region, mask, data, threshold_min, threshold_max, erase_enabled, original_image, checked):
+        if checked == 1:
+            # draw with threshold
+            pixel_values = original_image[region]
+            mask &= (pixel_values >= threshold_min - 150) & (pixel_values <= threshold_max + 150)
+
+        # Keep only the touched voxels' previous values for the history
+        before = data[region][mask]
+        value = 0 if erase_enabled else MASK_LEVEL
+        change.update(region=region, mask=mask, data=[before], bbox=self.changed_bbox(region, mask, before != value))
+        if erase_enabled:
+            self.erase_slices(data, region, mask)
+        else:
+            self.paint_slices(data, region, mask)
+
+    def changed_bbox(self, region, mask, changed=None):
+        # Bounding box of the voxels an edit changed, changed selects among the mask's voxels, None if nothing changed
+        if changed is not None:
+            mask = mask.copy()
+            mask[mask] = changed
+        objects = ndimage.find_objects(mask.astype(np.uint8))
+        if not objects:
+            return None
+        return tuple(slice(r.start + b.start, r.start + b.stop) for r, b in zip(region, objects[0]))
+
+    def brush_footprint(self, size, brush_shape='cube'):
+        # Boolean brush of side 2 * size - 1 centred on the clicked voxel
+        radius = size - 1
+        if brush_shape == 'sphere':
+            x, y, z = np.ogrid[-radius:radius + 1, -radius:radius + 1, -radius:radius + 1]
+            return x * x + y * y + z * z <= radius * radius
+        return np.ones((2 * radius + 1,) * 3, dtype=bool)
+
+    def brush_plane_axis(self, axial, sagittal, coronal, mult_sliced_checked):
+        # Without multiple slices the brush is the in-plane cross section (square or disk)
+        if mult_sliced_checked != 1:
+            if axial:
+                return 2
+            elif sagittal:
+                return 1
+            elif coronal:
+                return 0
+        return None
+
+    def brush_region(self, size, x_index, y_index, z_index, shape, axial, sagittal, coronal, mult_sliced_checked, brush_shape='cube'):
+        footprint = self.brush_footprint(size, brush_shape)
+        radius = size - 1
+        center = [x_index, y_index, z_index]
+        plane_axis = self.brush_plane_axis(axial, sagittal, coronal, mult_sliced_checked)
+
+        region = []
+        footprint_region = []
+        for axis in range(3):
+            if axis == plane_axis:
+                low, high = center[axis], center[axis] + 1
+                offset = radius
+            else:
+                low, high = center[axis] - radius, center[axis] + radius + 1
+                offset = 0
+            clipped_low = max(low, 0)
+            clipped_high = max(min(high, shape[axis]), clipped_low)
+            region.append(slice(clipped_low, clipped_high))
+            footprint_region.append(slice(offset + clipped_low - low, offset + clipped_high - low))
+
+        return tuple(region), footprint[tuple(footprint_region)].copy()
+
+    def stroke_path(self, points):
+        # Voxels on the straight segments between consecutive samples, at most one voxel apart along every axis
+        points = np.asarray(points, dtype=np.int64).reshape(-1, 3)
+        path = [points[:1]]
+        for start, stop in zip(points[:-1], points[1:]):
+            steps = int(np.abs(stop - start).max())
+            if steps:
+                fractions = np.arange(1, steps + 1)[:, np.newaxis] / steps
+                path.append(np.rint(start + (stop - start) * fractions).astype(np.int64))
+        return np.concatenate(path)
+
+    def stroke_region(self, size, path, shape, axial, sagittal, coronal, mult_sliced_checked, brush_shape='cube'):
+        # Union of brush_region over every voxel of the path. The brush is swept with a distance transform
+        # (sphere) or a separable maximum filter (cube), so the cost does not grow with the brush size.
+        radius = size - 1
+        plane_axis = self.brush_plane_axis(axial, sagittal, coronal, mult_sliced_checked)
+        extent = np.array([0 if axis == plane_axis else radius for axis in range(3)])
+        path = np.asarray(path, dtype=np.int64)
+        low = np.maximum(path.min(axis=0) - extent, 0)
+        high = np.minimum(path.max(axis=0) + extent + 1, shape)
+        region = tuple(slice(int(l), int(h)) for l, h in zip(low, high))
+
+        centers = np.zeros(high - low, dtype=bool)
+        centers[tuple((path - low).T)] = True
+        if brush_shape == 'sphere':
+            # Samples in other planes are kept out of a flat brush by spacing the planes wider than the radius
+            sampling = [radius + 1 if axis == plane_axis else 1 for axis in range(3)]
+            mask = ndimage.distance_transform_edt(~centers, sampling=sampling) <= radius
+        else:
+            mask = ndimage.maximum_filter(centers, size=2 * extent + 1)
+        return region, mask
 
-    def paint_slices(self, array1, array2, x, y, z):
-        array1[x, y, z] = [255, 0, 0]
-        array2[x, y, z] = 1
-    
-    def grow_from_seeds(self, x_index, y_index, z_index, original_image, data, data2, threshold_min, threshold_max):
-        seed_pixel_value = original_image[x_index, y_index, z_index]
+    def erase_slices(self, array, region, mask):
+        assign_masked(array, region, mask, 0)
 
-        data_copy = data.copy()
-        data2_copy = data2.copy()
+    def paint_slices(self, array, region, mask):
+        assign_masked(array, region, mask, MASK_LEVEL)
+    
+    @timed(category='edit')
+    def grow_from_seeds(self, x_index, y_index, z_index, original_image, data, threshold_min, threshold_max, connectivity=6, max_voxels=None):
+        change = {"action": "grow", "region": None, "mask": None, "data": [], "bbox": None}
         count = 0
-        max_pixels = 10000
-
-        if (threshold_min - 150) <= seed_pixel_value <= (threshold_max):
-            stack = [(x_index, y_index, z_index)]
-            visited = set()
-
-            while stack and count < max_pixels:
-                
-                current_pixel = stack.pop()
-                if current_pixel in visited:
-                    continue
-
-                visited.add(current_pixel)
-                x, y, z = current_pixel
-
-                if (0 <= x < data[1].shape[0]) and (0 <= y < data[1].shape[0]) and (0 <= z < data[1].shape[1]):
-                    if data2[x, y, z] == 0:
-                        pixel_value = original_image[x, y, z]
-                        if (threshold_min - 150) <= pixel_value <= (threshold_max):
-                            self.paint_slices(data, data2, x, y, z)
-                            count += 1
-                            stack.extend([(x + 1, y, z), (x - 1, y, z), (x, y + 1, z), (x, y - 1, z), (x, y, z + 1), (x, y, z - 1)])
-        print(count)
-        # Update the displayed slice
-        change = {"action": "grow", "data": data_copy}
-        change2 = {"action": "grow", "data": data2_copy}
-
-        return change, change2
 
+        region, component = self.grow_region((x_index, y_index, z_index), original_image, data, threshold_min - 150, threshold_max, connectivity, max_voxels)
+        if component is not None:
+            # The region is the component's bounding box and every voxel of it was unpainted
+            change.update(region=region, mask=component, data=[data[region][component]], bbox=region)
+            self.paint_slices(data, region, component)
+            count = int(np.count_nonzero(component))
+        print(count)
 
+        return change
+
+    def grow_region(self, seed, original_image, data, lower_thresh, higher_thresh, connectivity=6, max_voxels=None, window=32):
+        # Label the unpainted in-range voxels in a window around the seed, doubling the window
+        # on every face the seed's component touches until it is fully enclosed
+        shape = original_image.shape
+        if not all(0 <= c < n for c, n in zip(seed, shape)):
+            return None, None
+        structure = ndimage.generate_binary_structure(3, {6: 1, 18: 2, 26: 3}[connectivity])
+        low_extent = [window] * 3
+        high_extent = [window] * 3
+
+        while True:
+            region = tuple(slice(max(c - low, 0), min(c + high + 1, n)) for c, low, high, n in zip(seed, low_extent, high_extent, shape))
+            local_seed = tuple(c - r.start for c, r in zip(seed, region))
+            values = original_image[region]
+            candidates = (values >= lower_thresh) & (values <= higher_thresh) & (data[region] == 0)
+            if not candidates[local_seed]:
+                return None, None
+
+            labeled_image, _ = ndimage.label(candidates, structure=structure)
+            component = labeled_image == labeled_image[local_seed]
+            count = np.count_nonzero(component)
+
+            touches_border = False
+            for axis, (r, n) in enumerate(zip(region, shape)):
+                if r.start > 0 and component.take(0, axis=axis).any():
+                    low_extent[axis] *= 2
+                    touches_border = True
+                if r.stop < n and component.take(-1, axis=axis).any():
+                    high_extent[axis] *= 2
+                    touches_border = True
+            if not touches_border or (max_voxels is not None and count >= max_voxels):
+                break
+
+        if max_voxels is not None and count > max_voxels:
+            # Keep the voxels closest to the seed
+            coords = np.nonzero(component)
+            distances = sum((c - s) ** 2 for c, s in zip(coords, local_seed))
+            keep = np.argpartition(distances, max_voxels - 1)[:max_voxels]
+            component = np.zeros_like(component)
+            component[tuple(c[keep] for c in coords)] = True
+
+        # Shrink the window to the component's bounding box
+        bounding_box = ndimage.find_objects(component.astype(np.uint8))[0]
+        region = tuple(slice(r.start + b.start, r.start + b.stop) for r, b in zip(region, bounding_box))
+        return region, component[bounding_box]
@@ -0,0 +1,143 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy import ndimage
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from MaskVolume import soft_levels
+from Profiler import timed
+
+
+def chunk_bounds(depth, chunks):
+    # Split range(depth) into at most `chunks` contiguous z-ranges of near equal size
+    edges = np.linspace(0, depth, min(chunks, depth) + 1).round().astype(int)
+    return [(int(start), int(stop)) for start, stop in zip(edges[:-1], edges[1:]) if stop > start]
+
+
+class ChunkedPipeline(object):
+    # confrim_threshold split into z-chunks run on a thread pool, giving the same mask as the serial path.
+    # Thresholding and the morphology only work in-plane so chunks need no overlap there; the labels are
+    # joined across chunk borders before picking components, and the gaussian reads a halo of slices
+    # from the neighbouring chunks.
+    def __init__(self, calculator, max_workers=None, chunks=None):
+        self.calculator = calculator
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.chunks = chunks or self.max_workers
+
+    def run(self, cropped_data, lower_thresh, higher_thresh, k, min_size=0, connectivity=6, progress=None):
+        if progress is None:
+            progress = lambda done, total, stage: None
+        stages = 6
+        structure = ndimage.generate_binary_structure(3, {6: 1, 26: 3}[connectivity])
+        bounds = chunk_bounds(cropped_data.shape[2], self.chunks)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            progress(0, stages, 'Thresholding')
+            def label_chunk(bound):
+                start, stop = bound
+                data_threshold = self.calculator.threshold_roi(cropped_data[:, :, start:stop], lower_thresh, higher_thresh)
+                labels, num_features = ndimage.label(self.calculator.open_close(data_threshold), structure=structure)
+                return labels, num_features
+            labelled = list(pool.map(label_chunk, bounds))
+
+            progress(2, stages, 'Connected components')
+            lookups = self.select_components(labelled, bounds, cropped_data.shape, connectivity, k, min_size, pool)
+
+            progress(3, stages, 'Dilating and eroding')
+            halo = self.smoothing_halo()
+            levels = np.empty(cropped_data.shape, dtype=np.uint8)
+            def smooth_chunk(bound):
+                start, stop = bound
+                halo_start, halo_stop = max(start - halo, 0), min(stop + halo, cropped_data.shape[2])
+                filtered_data = self.kept_slab(labelled, lookups, bounds, halo_start, halo_stop)
+                smoothed = self.calculator.smooth(self.calculator.dilate_erode(filtered_data))
+                levels[:, :, start:stop] = soft_levels(smoothed[:, :, start - halo_start:stop - halo_start])
+            list(pool.map(smooth_chunk, bounds))
+
+        progress(5, stages, 'Storing mask')
+        return levels
+
+    def smoothing_halo(self):
+        # Slices the gaussian reaches on either side, scipy truncates the kernel at 4 sigma
+        return int(4.0 * self.calculator.smoothing_sigma + 0.5)
+
+    def kept_slab(self, labelled, lookups, bounds, start, stop):
+        # Binary mask of the kept components for slices start:stop, which may span several chunks
+        pieces = []
+        for (labels, _), lookup, (chunk_start, chunk_stop) in zip(labelled, lookups, bounds):
+            if chunk_stop > start and chunk_start < stop:
+                pieces.append(lookup[labels[:, :, max(start, chunk_start) - chunk_start:min(stop, chunk_stop) - chunk_start]])
+        return np.concatenate(pieces, axis=2)
+
+    @timed(category='threshold')
+    def select_components(self, labelled, bounds, shape, connectivity, k, min_size, pool):
+        # Chunk labels are numbered globally by offsetting each chunk by the labels before it
+        counts = [num_features for _, num_features in labelled]
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        total = int(offsets[-1])
+
+        sizes = np.zeros(total + 1, dtype=np.int64)
+        objects = list(pool.map(lambda chunk: ndimage.find_objects(chunk[0]), labelled))
+        for (labels, num_features), offset in zip(labelled, offsets):
+            sizes[offset + 1:offset + num_features + 1] = np.bincount(labels.ravel(), minlength=num_features + 1)[1:]
+
+        # Join labels touching across each chunk border into one component
+        if connectivity == 6:
+            shifts = [(0, 0)]
+        else:
+            shifts = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+        rows, cols = [], []
+        for index in range(len(labelled) - 1):
+            below = labelled[index][0][:, :, -1]
+            above = labelled[index + 1][0][:, :, 0]
+            for dx, dy in shifts:
+                a = below[max(dx, 0):below.shape[0] + min(dx, 0), max(dy, 0):below.shape[1] + min(dy, 0)]
+                b = above[max(-dx, 0):above.shape[0] + min(-dx, 0), max(-dy, 0):above.shape[1] + min(-dy, 0)]
+                touching = (a > 0) & (b > 0)
+                rows.append(a[touching].astype(np.int64) + offsets[index])
+                cols.append(b[touching].astype(np.int64) + offsets[index + 1])
+        rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+        cols = np.concatenate(cols) if cols else np.zeros(0, dtype=np.int64)
+        graph = coo_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(total + 1, total + 1))
+        _, component = connected_components(graph, directed=False)
+
+        # Background gets its own component id, its size stays 0
+        component_sizes = np.bincount(component, weights=sizes).astype(np.int64)
+        component_sizes[component[0]] = 0
+        keep = self.largest(component_sizes, k, max(min_size, 1), component, labelled, bounds, objects, offsets, shape)
+
+        kept_labels = keep[component]
+        kept_labels[0] = False
+        return [np.concatenate(([0], kept_labels[offset + 1:offset + num_features + 1])).astype(np.uint8)
+                for (_, num_features), offset in zip(labelled, offsets)]
+
+    def largest(self, component_sizes, k, min_size, component, labelled, bounds, objects, offsets, shape):
+        # The serial path breaks ties in favour of the component found last in C order, which is the one whose
+        # first voxel comes last; first voxels are only looked up for the components tied at the k-th size
+        keep = np.zeros(len(component_sizes), dtype=bool)
+        candidates = np.flatnonzero(component_sizes >= min_size)
+        if len(candidates) <= k:
+            keep[candidates] = True
+            return keep
+        cutoff = np.sort(component_sizes[candidates])[::-1][k - 1] if k > 0 else np.inf
+        keep[candidates[component_sizes[candidates] > cutoff]] = True
+        tied = candidates[component_sizes[candidates] == cutoff]
+        remaining = k - int(keep.sum())
+        if remaining > 0:
+            first = {int(c): np.inf for c in tied}
+            for index, ((labels, num_features), offset, (start, _)) in enumerate(zip(labelled, offsets, bounds)):
+                for local in np.flatnonzero(np.isin(component[offset + 1:offset + num_features + 1], tied)) + 1:
+                    comp = int(component[offset + local])
+                    first[comp] = min(first[comp], self.first_voxel(labels, local, objects[index][local - 1], start, shape))
+            tied = sorted(first, key=lambda comp: first[comp], reverse=True)
+            keep[tied[:remaining]] = True
+        return keep
+
+    def first_voxel(self, labels, label, bbox, z_offset, shape):
+        # C-order index in the full ROI of the first voxel of `label`, found on the first x plane of its box
+        x = bbox[0].start
+        plane = labels[x, bbox[1], bbox[2]] == label
+        y, z = np.unravel_index(np.argmax(plane), plane.shape)
+        return (x * shape[1] + bbox[1].start + y) * shape[2] + z_offset + bbox[2].start + z
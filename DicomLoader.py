@@ -0,0 +1,230 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import pydicom
+
+from Profiler import timed
+from VolumeCache import VolumeCache
+
+
+class LoadCancelled(Exception):
+    pass
+
+
+def read_header(path):
+    # Header only, pixel data is decoded later straight into the volume
+    try:
+        ds = pydicom.dcmread(path, stop_before_pixels=True)
+    except (pydicom.errors.InvalidDicomError, IsADirectoryError, PermissionError):
+        return None
+    if 'Rows' not in ds or 'ImagePositionPatient' not in ds:
+        return None
+
+    orientation = [float(v) for v in ds.get('ImageOrientationPatient', [1, 0, 0, 0, 1, 0])]
+    row_spacing, column_spacing = [float(v) for v in ds.get('PixelSpacing', [1, 1])]
+    stat = os.stat(path)
+    return {
+        'path': path,
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'series_instance_uid': str(ds.get('SeriesInstanceUID', '')),
+        'series_description': str(ds.get('SeriesDescription', '')),
+        'modality': str(ds.get('Modality', '')),
+        'position': [float(v) for v in ds.ImagePositionPatient],
+        'orientation': orientation,
+        'rows': int(ds.Rows),
+        'columns': int(ds.Columns),
+        'row_spacing': row_spacing,
+        'column_spacing': column_spacing,
+        'slice_thickness': float(ds.get('SliceThickness', 0) or 0),
+        'rescale_slope': float(ds.get('RescaleSlope', 1) or 1),
+        'rescale_intercept': float(ds.get('RescaleIntercept', 0) or 0),
+    }
+
+
+def summarize_series(headers):
+    first = headers[0]
+    return {
+        'series_instance_uid': first['series_instance_uid'],
+        'series_description': first['series_description'],
+        'modality': first['modality'],
+        'slices': len(headers),
+        'rows': first['rows'],
+        'columns': first['columns'],
+        'directory': os.path.dirname(first['path']),
+    }
+
+
+def scan_series(data_path, max_workers=None):
+    # Lists the series found in a folder from their headers only
+    return DicomSeriesLoader(data_path, max_workers).scan()
+
+
+class DicomSeriesLoader(object):
+    def __init__(self, data_path, max_workers=None, cache=None):
+        self.data_path = data_path
+        self.max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+        self.cache = cache
+        self.cancel_event = threading.Event()
+        self.series = None
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def list_files(self):
+        return sorted(os.path.join(self.data_path, f) for f in os.listdir(self.data_path)
+                      if not f.startswith('.') and os.path.isfile(os.path.join(self.data_path, f)))
+
+    def scan(self, pool=None, progress=None):
+        # Header-only pass grouping the folder's images by SeriesInstanceUID, no pixel data is decoded
+        if pool is None:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                return self.scan(pool, progress)
+
+        self.series = {}
+        paths = self.list_files()
+        futures = [pool.submit(read_header, path) for path in paths]
+        try:
+            for done, future in enumerate(futures, start=1):
+                header = future.result()
+                if header is not None:
+                    self.series.setdefault(header['series_instance_uid'], []).append(header)
+                if progress is not None:
+                    progress(done, len(paths), 'Reading headers')
+                if self.cancel_event.is_set():
+                    self.series = None
+                    raise LoadCancelled(self.data_path)
+        finally:
+            for pending in futures:
+                pending.cancel()
+
+        # Sort each series along its slice normal, lowest position first
+        for headers in self.series.values():
+            orientation = np.array(headers[0]['orientation'])
+            normal = np.cross(orientation[:3], orientation[3:])
+            for header in headers:
+                header['location'] = float(np.dot(normal, header['position']))
+            headers.sort(key=lambda header: header['location'])
+        return [summarize_series(headers) for headers in self.series.values()]
+
+    def read_headers(self, pool, series_instance_uid=None):
+        if self.series is None:
+            self.scan(pool)
+        if not self.series:
+            raise ValueError(f"No DICOM images found in {self.data_path}")
+
+        # Keep the series with the most slices unless one was chosen
+        if series_instance_uid is None:
+            series_instance_uid = max(self.series, key=lambda uid: len(self.series[uid]))
+        return self.series[series_instance_uid]
+
+    def metadata(self, headers):
+        first = headers[0]
+        locations = [header['location'] for header in headers]
+        if len(locations) > 1:
+            slice_spacing = float(np.median(np.diff(locations)))
+        else:
+            slice_spacing = first['slice_thickness'] or 1.0
+        return {
+            'series_instance_uid': first['series_instance_uid'],
+            'image_position_patient': tuple(first['position']),
+            'pixel_spacing': (first['column_spacing'], first['row_spacing'], slice_spacing),
+            'image_orientation': tuple(first['orientation']),
+            'slice_thickness': first['slice_thickness'],
+            'shape': (first['columns'], first['rows'], len(headers)),
+        }
+
+    @timed(category='load')
+    def load(self, progress=None, series_instance_uid=None):
+        self.cancel_event.clear()
+        error = None
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            headers = self.read_headers(pool, series_instance_uid)
+            metadata = self.metadata(headers)
+
+            if self.cache is not None:
+                cache_key = self.cache.key(headers)
+                cached = self.cache.load(cache_key)
+                if cached is not None:
+                    buffer, metadata = cached
+                    if progress is not None:
+                        progress(len(headers), len(headers))
+                    return buffer.transpose(2, 1, 0), metadata
+
+            integer_rescale = all(float(h['rescale_slope']).is_integer() and float(h['rescale_intercept']).is_integer() for h in headers)
+            columns, rows, slices = metadata['shape']
+            dtype = np.int16 if integer_rescale else np.float32
+            buffer = None
+            if self.cache is not None:
+                try:
+                    buffer = self.cache.create(cache_key, (slices, rows, columns), dtype)
+                except OSError as cache_error:
+                    # Read-only, over quota or full cache folder, the series is decoded in memory instead
+                    print(f"Volume cache not used: {cache_error}")
+                    self.cache.discard(cache_key)
+            mapped = buffer is not None
+            if not mapped:
+                buffer = np.empty((slices, rows, columns), dtype=dtype)
+
+            try:
+                self.decode_slices(pool, headers, buffer, progress)
+            except BaseException as exception:
+                # A failed slice or an interrupting progress callback stops the remaining slices
+                self.cancel_event.set()
+                error = exception
+
+        if mapped and self.cancel_event.is_set():
+            del buffer
+            self.cache.discard(cache_key)
+        elif mapped:
+            try:
+                buffer.flush()
+            except OSError as cache_error:
+                print(f"Volume cache not used: {cache_error}")
+                buffer = np.array(buffer)
+                self.cache.discard(cache_key)
+            else:
+                # Reopen the decoded file read-only so slices are paged in from disk on demand
+                del buffer
+                try:
+                    self.cache.commit(cache_key, metadata)
+                except OSError as cache_error:
+                    print(f"Volume cache not used: {cache_error}")
+                    buffer = self.cache.read_pending(cache_key)
+                else:
+                    buffer, metadata = self.cache.load(cache_key)
+        if error is not None:
+            raise error
+        if self.cancel_event.is_set():
+            raise LoadCancelled(self.data_path)
+
+        # Same indexing as the VTK reader: volume[column, row, slice]
+        volume = buffer.transpose(2, 1, 0)
+        return volume, metadata
+
+    @timed(category='load')
+    def decode_slices(self, pool, headers, buffer, progress=None):
+        # Each slice is decoded into its own contiguous block of the buffer
+        def decode(index):
+            if self.cancel_event.is_set():
+                return
+            header = headers[index]
+            pixels = pydicom.dcmread(header['path']).pixel_array
+            if header['rescale_slope'] == 1:
+                np.add(pixels, header['rescale_intercept'], out=buffer[index], casting='unsafe')
+            else:
+                buffer[index] = pixels * header['rescale_slope'] + header['rescale_intercept']
+
+        futures = [pool.submit(decode, index) for index in range(len(headers))]
+        try:
+            for done, future in enumerate(as_completed(futures), start=1):
+                future.result()
+                if progress is not None:
+                    progress(done, len(futures))
+                if self.cancel_event.is_set():
+                    break
+        finally:
+            for pending in futures:
+                pending.cancel()
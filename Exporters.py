@@ -0,0 +1,216 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+from Profiler import timed
+
+# SimpleITK is imported by the functions that write files, so the app and the exporter list load without it
+
+
+def to_dicom_orientation(array):
+    # Viewer indexing volume[column, row, slice] back to the (slice, row, column) order of the DICOM files
+    array = array[::-1, :, :]
+    array = np.rot90(array, k=-1, axes=(0, 1))
+    return np.transpose(array, axes=(2, 0, 1))
+
+
+@timed(category='export')
+def write_dicom_slices(array, subdirectory, pixel_spacing, image_position_patient, slice_thickness, progress=None, max_workers=None, queue_size=None):
+    # One uint16 DICOM file per axial slice of a combined mask in viewer indexing.
+    # Slices are taken straight from the array and written on a thread pool, at most queue_size at a time.
+    import SimpleITK as sitk
+    depth = array.shape[2]
+    max_workers = max_workers or min(8, (os.cpu_count() or 1) + 2)
+    slots = threading.BoundedSemaphore(queue_size or 2 * max_workers)
+    writers = threading.local()
+
+    if not os.path.exists(subdirectory):
+        os.makedirs(subdirectory)
+
+    def write(i, pixels):
+        try:
+            if not hasattr(writers, 'writer'):
+                writers.writer = sitk.ImageFileWriter()
+                writers.writer.KeepOriginalImageUIDOn()
+            write_dicom_slice(writers.writer, pixels, i, subdirectory, pixel_spacing, image_position_patient, slice_thickness)
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = []
+        finished = 0
+        try:
+            for i in range(depth):
+                slots.acquire()
+                # Row-major (row, column) slice as in the DICOM files, cast like sitk.Cast to UInt16
+                pixels = np.ascontiguousarray(array[:, :, i].T).astype(np.uint16)
+                pending.append(pool.submit(write, i, pixels))
+                # Written slices are checked while queueing, so a failure stops the loop right away
+                written = [future for future in pending if future.done()]
+                if written:
+                    pending = [future for future in pending if future not in written]
+                    for future in written:
+                        future.result()
+                    finished += len(written)
+                    if progress is not None:
+                        progress(finished, depth, 'Writing slices')
+            for future in as_completed(pending):
+                future.result()
+                finished += 1
+                if progress is not None:
+                    progress(finished, depth, 'Writing slices')
+        except BaseException:
+            # Queued slices are dropped before leaving the pool, which only waits for the ones being written
+            for future in pending:
+                future.cancel()
+            raise
+
+    print(f"DICOM files saved in: {subdirectory}")
+
+
+def write_dicom_slice(writer, pixels, i, subdirectory, pixel_spacing, image_position_patient, slice_thickness):
+    import SimpleITK as sitk
+    spacing = pixel_spacing
+    origin = image_position_patient
+
+    series_uid = "A"
+    study_uid = 'B'
+    thickness = slice_thickness
+
+    # Same geometry as slice i of the volume image the slices used to be cut from
+    image_slice = sitk.GetImageFromArray(pixels)
+    image_slice.SetSpacing([spacing[0], spacing[1]])
+    image_slice.SetOrigin((origin[0], origin[1]))
+
+    # Set metadata for each slice
+    image_slice.SetMetaData("0010|0010", "Output Patient")
+    image_slice.SetMetaData("0010|0020", "CT_vessl")
+    image_slice.SetMetaData("0020|000d", study_uid)
+    image_slice.SetMetaData("0020|000e", series_uid)
+    image_slice.SetMetaData("0008|0020", time.strftime("%Y%m%d"))
+    image_slice.SetMetaData("0008|0030", time.strftime("%H%M%S"))
+    image_slice.SetMetaData("0018|0088", str(thickness))
+    image_slice.SetMetaData("0018|9306", str(thickness))
+    image_slice.SetMetaData("0028|0030", f"{spacing[0]}\\{spacing[1]}")
+    image_position = f"{origin[0]}\\{origin[1]}\\{origin[2] + i*thickness}"
+    image_slice.SetMetaData("0020|0032", image_position)
+    image_slice.SetMetaData("0018|0050", str(thickness))
+    image_slice.SetMetaData("0018|103e", 'CoW')
+    image_slice.SetMetaData("0020|0052", series_uid)
+    image_slice.SetMetaData("0008|0012", time.strftime("%Y%m%d"))
+    image_slice.SetMetaData("0008|0013", time.strftime("%H%M%S"))
+    image_slice.SetMetaData("0008|0060", "CT")
+    image_slice.SetMetaData("0020|0037", "1.000000\\0.000000\\0.000000\\0.000000\\1.000000\\0.000000")
+    image_slice.SetMetaData("0020|0013", str(i))
+
+    filename = os.path.join(subdirectory, f"{str(i)}.dcm")
+
+    writer.SetFileName(filename)
+    writer.Execute(image_slice)
+
+
+def label_dtype(array):
+    # Smallest unsigned type holding the combined mask values
+    return np.uint8 if array.max(initial=0) <= np.iinfo(np.uint8).max else np.uint16
+
+
+def label_image(array, metadata):
+    # Label map on the grid of the loaded series: index (column, row, slice), origin at the first slice
+    import SimpleITK as sitk
+    labels = to_dicom_orientation(array).astype(label_dtype(array))
+    image = sitk.GetImageFromArray(labels)
+    spacing = list(metadata['pixel_spacing'])
+    if len(spacing) < 3:
+        spacing.append(metadata['slice_thickness'])
+    image.SetSpacing([float(v) for v in spacing[:3]])
+    image.SetOrigin([float(v) for v in metadata['image_position_patient']])
+    orientation = np.array(metadata.get('image_orientation') or (1, 0, 0, 0, 1, 0), dtype=float)
+    direction = np.stack([orientation[:3], orientation[3:], np.cross(orientation[:3], orientation[3:])], axis=1)
+    image.SetDirection(direction.ravel().tolist())
+    return image
+
+
+class Exporter(object):
+    # Writes a combined mask (viewer indexing, values 0..100 per structure) next to the loaded series
+    key = ''
+    name = ''
+    extension = ''
+
+    def output_path(self, output_dir, name):
+        return os.path.join(output_dir, name + self.extension)
+
+    def export(self, array, path, metadata, progress=None):
+        raise NotImplementedError
+
+
+class DicomSliceExporter(Exporter):
+    key = 'dicom'
+    name = 'DICOM slices'
+
+    @timed(category='export')
+    def export(self, array, path, metadata, progress=None):
+        write_dicom_slices(array, path, metadata['pixel_spacing'], metadata['image_position_patient'], metadata['slice_thickness'], progress)
+        return path
+
+
+class SimpleITKExporter(Exporter):
+    # Single compressed file written by SimpleITK, which also converts the geometry for the format
+    @timed(category='export')
+    def export(self, array, path, metadata, progress=None):
+        import SimpleITK as sitk
+        if progress is not None:
+            progress(0, 2, 'Building label map')
+        image = label_image(array, metadata)
+        if progress is not None:
+            progress(1, 2, 'Compressing')
+        sitk.WriteImage(image, path, useCompression=True)
+        if progress is not None:
+            progress(2, 2, 'Done')
+        print(f"Label map saved in: {path}")
+        return path
+
+
+class NiftiExporter(SimpleITKExporter):
+    key = 'nifti'
+    name = 'NIfTI (.nii.gz)'
+    extension = '.nii.gz'
+
+
+class NrrdExporter(SimpleITKExporter):
+    key = 'nrrd'
+    name = 'NRRD (.nrrd)'
+    extension = '.nrrd'
+
+
+class NpzExporter(Exporter):
+    key = 'npz'
+    name = 'NumPy (.npz)'
+    extension = '.npz'
+
+    @timed(category='export')
+    def export(self, array, path, metadata, progress=None):
+        import SimpleITK as sitk
+        if progress is not None:
+            progress(0, 1, 'Compressing')
+        image = label_image(array, metadata)
+        np.savez_compressed(path, labels=sitk.GetArrayViewFromImage(image), spacing=image.GetSpacing(),
+                            origin=image.GetOrigin(), direction=image.GetDirection())
+        if progress is not None:
+            progress(1, 1, 'Done')
+        print(f"Label map saved in: {path}")
+        return path
+
+
+EXPORTERS = {}
+
+
+def register_exporter(exporter):
+    EXPORTERS[exporter.key] = exporter
+    return exporter
+
+
+for exporter in (DicomSliceExporter(), NiftiExporter(), NrrdExporter(), NpzExporter()):
+    register_exporter(exporter)
@@ -0,0 +1,126 @@
+import numpy as np
+
+from MaskVolume import assign_masked
+
+
+def encode_mask(mask):
+    # Store a boolean mask as runs of consecutive flat indices or as packed bits, whichever is smaller
+    flat = np.flatnonzero(mask)
+    breaks = np.flatnonzero(np.diff(flat) != 1) + 1
+    starts = flat[np.r_[0, breaks]] if flat.size else flat
+    lengths = np.diff(np.r_[0, breaks, flat.size]) if flat.size else flat
+    index_dtype = np.int32 if mask.size < 2 ** 31 else np.int64
+    runs = np.stack((starts, lengths)).astype(index_dtype)
+    packed = np.packbits(mask, axis=None)
+    if runs.nbytes < packed.nbytes:
+        return 'rle', runs
+    return 'bits', packed
+
+
+def decode_mask(encoding, payload, shape):
+    size = int(np.prod(shape))
+    if encoding == 'bits':
+        return np.unpackbits(payload, count=size).astype(bool).reshape(shape)
+    starts, lengths = payload.astype(np.int64)
+    marks = np.zeros(size + 1, dtype=np.int8)
+    marks[starts] = 1
+    marks[starts + lengths] = -1
+    return (np.cumsum(marks[:-1]) > 0).reshape(shape)
+
+
+def encode_values(values):
+    # Values that are either 0 or a single label (masks) are bit-packed, anything else is kept as is
+    if values.ndim == 1 and values.size:
+        label = values.max()
+        if np.all((values == 0) | (values == label)):
+            return 'bits', np.packbits(values != 0), values.dtype, values.size, label
+    return 'raw', values, values.dtype, values.size, None
+
+
+def decode_values(encoded):
+    encoding, payload, dtype, size, label = encoded
+    if encoding == 'bits':
+        return np.unpackbits(payload, count=size).astype(dtype) * label
+    return payload
+
+
+class Delta(object):
+    def __init__(self, action, region, mask, before, after):
+        self.action = action
+        self.region = region
+        self.shape = mask.shape
+        self.count = int(np.count_nonzero(mask))
+        self.mask_encoding, self.mask_payload = encode_mask(mask)
+        self.before = [encode_values(values) for values in before]
+        self.after = [encode_values(values) for values in after]
+
+    @property
+    def nbytes(self):
+        return self.mask_payload.nbytes + sum(encoded[1].nbytes for encoded in self.before + self.after)
+
+    def mask(self):
+        return decode_mask(self.mask_encoding, self.mask_payload, self.shape)
+
+    def apply(self, arrays, encoded_values):
+        mask = self.mask()
+        for array, encoded in zip(arrays, encoded_values):
+            if array is not None:
+                assign_masked(array, self.region, mask, decode_values(encoded))
+
+
+class ChangeHistory(object):
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.undo_stack = []
+        self.redo_stack = []
+
+    @property
+    def nbytes(self):
+        return sum(delta.nbytes for delta in self.undo_stack + self.redo_stack)
+
+    def push(self, change, arrays):
+        # change holds the edited region, the boolean mask of touched voxels within it
+        # and the values those voxels had in each array before the edit
+        if change is None or change["region"] is None or not change["mask"].any():
+            return None
+        region, mask = change["region"], change["mask"]
+        after = [array[region][mask] for array in arrays]
+        delta = Delta(change["action"], region, mask, change["data"], after)
+        self.undo_stack.append(delta)
+        self.redo_stack = []
+        self.evict()
+        return delta
+
+    def undo(self, arrays):
+        if not self.undo_stack:
+            return None
+        delta = self.undo_stack.pop()
+        delta.apply(arrays, delta.before)
+        self.redo_stack.append(delta)
+        return delta
+
+    def redo(self, arrays):
+        if not self.redo_stack:
+            return None
+        delta = self.redo_stack.pop()
+        delta.apply(arrays, delta.after)
+        self.undo_stack.append(delta)
+        return delta
+
+    def set_max_bytes(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.evict()
+
+    def evict(self):
+        # Drop redo entries first, then the oldest undo entries, always keeping the latest edit
+        while self.redo_stack and self.nbytes > self.max_bytes:
+            self.redo_stack.pop(0)
+        while len(self.undo_stack) > 1 and self.nbytes > self.max_bytes:
+            self.undo_stack.pop(0)
+
+    def clear(self):
+        self.undo_stack = []
+        self.redo_stack = []
+
+    def __len__(self):
+        return len(self.undo_stack)
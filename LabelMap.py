@@ -0,0 +1,54 @@
+import numpy as np
+
+from MaskVolume import MaskVolume, MASK_LEVEL
+
+
+def fitting_dtype(low, high):
+    # Smallest type holding the summed structures, uint8 for the usual few non-overlapping ones
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if low >= 0 and high <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+class LabelMap(object):
+    # Stored structures summed into one full-size volume on the 0..scale_factor scale of the saved masks.
+    # Structures are added as they are stored, so saving and the 3D view read it without summing again.
+    def __init__(self, shape, scale_factor=100):
+        self.shape = tuple(shape)
+        self.scale_factor = scale_factor
+        self.data = np.zeros(self.shape, dtype=np.uint8)
+        self.bbox = None
+        self.count = 0
+
+    def add(self, image):
+        if isinstance(image, MaskVolume):
+            if image.bbox is not None:
+                self.accumulate(image.bbox, image.data.astype(np.int64) * self.scale_factor // MASK_LEVEL)
+        elif image.shape[2] != self.shape[2]:
+            # Binary volumes loaded from disk, shorter ones are aligned with the first slice
+            print('Not the same shape')
+            self.accumulate((slice(0, image.shape[0]), slice(0, image.shape[1]), slice(0, image.shape[2])), np.asarray(image, dtype=np.int64))
+        else:
+            self.accumulate((slice(0, image.shape[0]), slice(0, image.shape[1]), slice(0, image.shape[2])), np.asarray(image, dtype=np.int64) * self.scale_factor)
+        self.count += 1
+
+    def accumulate(self, bbox, values):
+        if values.size == 0:
+            return
+        region = self.data[bbox]
+        low = min(int(region.min()) + int(values.min()), 0)
+        high = int(region.max()) + int(values.max())
+        dtype = fitting_dtype(low, high)
+        if np.promote_types(dtype, self.data.dtype) != self.data.dtype:
+            self.data = self.data.astype(np.promote_types(dtype, self.data.dtype))
+            region = self.data[bbox]
+        region += values.astype(self.data.dtype)
+        self.bbox = bbox if self.bbox is None else tuple(
+            slice(min(a.start, b.start), max(a.stop, b.stop)) for a, b in zip(self.bbox, bbox))
+
+    def sync(self, images):
+        # Adds the images appended to the list since the last call
+        for image in images[self.count:]:
+            self.add(image)
+        return self
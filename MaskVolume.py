@@ -0,0 +1,128 @@
+import numpy as np
+from scipy import ndimage
+
+# Masks are stored as uint8 levels, MASK_LEVEL being fully inside the structure
+MASK_LEVEL = 255
+
+
+def soft_levels(values):
+    # Quantise a 0..1 (soft) mask into uint8 levels
+    return (values * MASK_LEVEL).astype(np.uint8)
+
+def assign_masked(array, region, mask, values):
+    # Read-modify-write so the same call works on numpy arrays and MaskVolume
+    region_values = array[region]
+    region_values[mask] = values
+    array[region] = region_values
+
+
+class MaskVolume(object):
+    # Full-size mask that only stores the bounding box holding labelled voxels
+    def __init__(self, shape, bbox=None, data=None):
+        self.shape = tuple(shape)
+        self.ndim = len(self.shape)
+        self.dtype = np.dtype(np.uint8)
+        self.bbox = bbox
+        if bbox is not None and data is None:
+            data = np.zeros([s.stop - s.start for s in bbox], dtype=self.dtype)
+        self.data = data
+
+    @classmethod
+    def from_soft(cls, shape, bbox, values):
+        return cls(shape, bbox, soft_levels(values))
+
+    @property
+    def nbytes(self):
+        return 0 if self.data is None else self.data.nbytes
+
+    def copy(self):
+        return MaskVolume(self.shape, self.bbox, None if self.data is None else self.data.copy())
+
+    def normalize(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = key + (slice(None),) * (self.ndim - len(key))
+        bounds = []
+        for k, n in zip(key, self.shape):
+            if isinstance(k, slice):
+                start, stop, step = k.indices(n)
+                if step != 1:
+                    raise IndexError("MaskVolume only supports unit-step slices")
+                bounds.append((start, max(stop, start), True))
+            else:
+                k = int(k)
+                if k < 0:
+                    k += n
+                if not 0 <= k < n:
+                    raise IndexError(f"Index {k} out of bounds for axis with size {n}")
+                bounds.append((k, k + 1, False))
+        return bounds
+
+    def contains(self, bounds):
+        if self.bbox is None:
+            return False
+        return all(b.start <= low and high <= b.stop for (low, high, _), b in zip(bounds, self.bbox))
+
+    def local_key(self, bounds):
+        return tuple(slice(low - b.start, high - b.start) if is_slice else low - b.start
+                     for (low, high, is_slice), b in zip(bounds, self.bbox))
+
+    def __getitem__(self, key):
+        bounds = self.normalize(key)
+        if self.contains(bounds):
+            return self.data[self.local_key(bounds)]
+
+        # Region reaches outside the stored box, fill the rest with zeros
+        result = np.zeros([high - low for low, high, _ in bounds], dtype=self.dtype)
+        if self.bbox is not None:
+            overlap = [(max(low, b.start), min(high, b.stop)) for (low, high, _), b in zip(bounds, self.bbox)]
+            if all(low < high for low, high in overlap):
+                target = tuple(slice(low - bound[0], high - bound[0]) for (low, high), bound in zip(overlap, bounds))
+                source = tuple(slice(low - b.start, high - b.start) for (low, high), b in zip(overlap, self.bbox))
+                result[target] = self.data[source]
+        squeeze = tuple(axis for axis, (_, _, is_slice) in enumerate(bounds) if not is_slice)
+        return result.squeeze(axis=squeeze) if squeeze else result
+
+    def __setitem__(self, key, values):
+        bounds = self.normalize(key)
+        if any(low == high for low, high, _ in bounds):
+            return
+        self.expand([slice(low, high) for low, high, _ in bounds])
+        self.data[self.local_key(bounds)] = values
+
+    def expand(self, region):
+        # Grow the stored box so it covers region
+        if self.bbox is None:
+            self.bbox = tuple(region)
+            self.data = np.zeros([s.stop - s.start for s in region], dtype=self.dtype)
+            return
+        if all(b.start <= r.start and r.stop <= b.stop for r, b in zip(region, self.bbox)):
+            return
+        new_bbox = tuple(slice(min(r.start, b.start), max(r.stop, b.stop)) for r, b in zip(region, self.bbox))
+        new_data = np.zeros([s.stop - s.start for s in new_bbox], dtype=self.dtype)
+        new_data[tuple(slice(b.start - n.start, b.stop - n.start) for b, n in zip(self.bbox, new_bbox))] = self.data
+        self.bbox = new_bbox
+        self.data = new_data
+
+    def shrink(self):
+        # Crop the stored box to the labelled voxels
+        if self.data is None:
+            return self
+        objects = ndimage.find_objects((self.data > 0).astype(np.uint8))
+        if not objects:
+            self.bbox = None
+            self.data = None
+            return self
+        local = objects[0]
+        self.bbox = tuple(slice(b.start + l.start, b.start + l.stop) for b, l in zip(self.bbox, local))
+        self.data = self.data[local].copy()
+        return self
+
+    def dense(self, dtype=np.uint8):
+        array = np.zeros(self.shape, dtype=dtype)
+        if self.bbox is not None:
+            array[self.bbox] = self.data
+        return array
+
+    def count_nonzero(self):
+        return 0 if self.data is None else int(np.count_nonzero(self.data))
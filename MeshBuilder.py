@@ -0,0 +1,64 @@
+import numpy as np
+import vtkmodules.all as vtk
+from vtk.util import numpy_support
+
+from Profiler import timed
+
+
+def crop_to_bbox(data, bbox, pad=1):
+    # Bounding box grown by `pad` voxels so surfaces touching it stay closed, as a Fortran-ordered uint8 copy
+    # whose memory VTK can use as is (x fastest)
+    bounds = [(max(s.start - pad, 0), min(s.stop + pad, n)) for s, n in zip(bbox, data.shape)]
+    region = data[tuple(slice(start, stop) for start, stop in bounds)]
+    if region.dtype != np.uint8:
+        region = np.minimum(region, np.iinfo(np.uint8).max)
+    return np.array(region, dtype=np.uint8, order='F'), [start for start, _ in bounds]
+
+
+@timed(category='3d')
+def build_mesh(region, start, spacing, level=50, target_reduction=0.5, smoothing_iterations=15, progress=None):
+    # Surface of the stored structures at `level` on their 0..100 scale. region and start come from crop_to_bbox,
+    # called by the caller so the job owns its copy while new structures are added to the label map.
+    if progress is None:
+        progress = lambda done, total, stage: None
+    stages = 4
+
+    progress(0, stages, 'Extracting surface')
+    scalars = numpy_support.numpy_to_vtk(region.ravel(order='F'), deep=False, array_type=vtk.VTK_UNSIGNED_CHAR)
+    image_data = vtk.vtkImageData()
+    image_data.SetDimensions(*region.shape)
+    image_data.SetSpacing(*spacing)
+    image_data.SetOrigin(*[s * d for s, d in zip(start, spacing)])
+    image_data.GetPointData().SetScalars(scalars)
+
+    surface = vtk.vtkFlyingEdges3D()
+    surface.SetInputData(image_data)
+    surface.SetValue(0, level)
+    surface.ComputeNormalsOff()
+    surface.Update()
+
+    progress(1, stages, 'Decimating')
+    decimate = vtk.vtkDecimatePro()
+    decimate.SetInputConnection(surface.GetOutputPort())
+    decimate.SetTargetReduction(target_reduction)
+    decimate.PreserveTopologyOn()
+    decimate.Update()
+
+    progress(2, stages, 'Smoothing')
+    smoother = vtk.vtkWindowedSincPolyDataFilter()
+    smoother.SetInputConnection(decimate.GetOutputPort())
+    smoother.SetNumberOfIterations(smoothing_iterations)
+    smoother.SetPassBand(0.1)
+    smoother.NonManifoldSmoothingOn()
+    smoother.NormalizeCoordinatesOn()
+
+    normals = vtk.vtkPolyDataNormals()
+    normals.SetInputConnection(smoother.GetOutputPort())
+    normals.SplittingOff()
+    normals.Update()
+
+    progress(3, stages, 'Done')
+    mesh = vtk.vtkPolyData()
+    mesh.DeepCopy(normals.GetOutput())
+    progress(stages, stages, 'Done')
+    return mesh
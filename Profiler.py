@@ -0,0 +1,146 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from functools import wraps
+
+try:
+    import resource
+except ImportError:
+    # Windows, spans are recorded without the RSS column
+    resource = None
+
+
+def max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    if resource is None:
+        return 0.0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def array_bytes(value):
+    # Bytes of the arrays in a result, MaskVolume and containers such as the change dicts included
+    if isinstance(value, (tuple, list)):
+        return sum(array_bytes(v) for v in value)
+    if isinstance(value, dict):
+        return sum(array_bytes(v) for v in value.values())
+    nbytes = getattr(value, 'nbytes', 0)
+    return nbytes if isinstance(nbytes, int) else 0
+
+
+class Span(object):
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.thread = threading.get_native_id()
+        self.start = time.perf_counter()
+        self.duration = 0.0
+        self.rss_delta_mb = 0.0
+        self.allocated = 0
+
+    def allocate(self, value):
+        self.allocated += array_bytes(value)
+
+
+class Profiler(object):
+    # Named spans of work with their wall time, how much they raised the peak RSS and the bytes of the arrays
+    # they produced. The last `history` spans feed stats(), every span is kept while recording for a Chrome trace.
+    def __init__(self, history=1000):
+        self.enabled = True
+        self.recent = deque(maxlen=history)
+        self.recorded = None
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, category='app', **args):
+        if not self.enabled:
+            yield None
+            return
+        span = Span(name, category, args)
+        rss = max_rss_mb()
+        try:
+            yield span
+        finally:
+            span.duration = time.perf_counter() - span.start
+            span.rss_delta_mb = max_rss_mb() - rss
+            with self.lock:
+                self.recent.append(span)
+                if self.recorded is not None:
+                    self.recorded.append(span)
+
+    def timed(self, name=None, category='app'):
+        # Decorator running the function in a span, the arrays it returns are counted as its allocation
+        def decorator(func):
+            label = name or func.__qualname__
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(label, category) as span:
+                    result = func(*args, **kwargs)
+                    if span is not None:
+                        span.allocate(result)
+                    return result
+            return wrapper
+        return decorator
+
+    def start_recording(self):
+        with self.lock:
+            self.recorded = []
+
+    def stop_recording(self):
+        with self.lock:
+            spans, self.recorded = self.recorded, None
+        return spans or []
+
+    @property
+    def recording(self):
+        return self.recorded is not None
+
+    def clear(self):
+        with self.lock:
+            self.recent.clear()
+
+    def stats(self):
+        # Per span name over the recent spans, slowest total first
+        with self.lock:
+            spans = list(self.recent)
+        rows = OrderedDict()
+        for span in spans:
+            row = rows.setdefault(span.name, {'name': span.name, 'category': span.category, 'count': 0, 'total': 0.0,
+                                              'max': 0.0, 'last': 0.0, 'rss_mb': 0.0, 'allocated': 0})
+            row['count'] += 1
+            row['total'] += span.duration
+            row['max'] = max(row['max'], span.duration)
+            row['last'] = span.duration
+            row['rss_mb'] += span.rss_delta_mb
+            row['allocated'] += span.allocated
+        for row in rows.values():
+            row['mean'] = row['total'] / row['count']
+        return sorted(rows.values(), key=lambda row: row['total'], reverse=True)
+
+    def trace_events(self, spans):
+        # Complete ("X") events of the Chrome trace format in microseconds of the monotonic clock, which is shared
+        # by the batch worker processes
+        pid = os.getpid()
+        return [{'name': span.name, 'cat': span.category, 'ph': 'X', 'pid': pid, 'tid': span.thread,
+                 'ts': round(span.start * 1e6, 1), 'dur': round(span.duration * 1e6, 1),
+                 'args': dict(span.args, rss_delta_mb=round(span.rss_delta_mb, 2), allocated_bytes=span.allocated)}
+                for span in spans]
+
+    def dump_chrome_trace(self, path, spans, events=None):
+        # Loads in chrome://tracing or Perfetto, trace events from other processes can be merged in
+        trace_events = self.trace_events(spans) + list(events or [])
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, f)
+        return len(trace_events)
+
+
+# Shared by the app, the calculator and the background jobs
+PROFILER = Profiler()
+span = PROFILER.span
+timed = PROFILER.timed
@@ -0,0 +1,73 @@
+from PyQt5 import QtCore, QtWidgets
+
+from Profiler import PROFILER
+
+COLUMNS = ('Span', 'Calls', 'Mean ms', 'Max ms', 'Last ms', 'Peak RSS +MB', 'Arrays MB')
+
+
+class ProfilerPanel(QtWidgets.QWidget):
+    # Rolling statistics of the profiler spans, refreshed while the panel is visible.
+    # Recording keeps every span until it is stopped and saved as a Chrome trace.
+    def __init__(self, parent=None, profiler=PROFILER):
+        super().__init__(parent)
+        self.profiler = profiler
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+
+        self.table = QtWidgets.QTableWidget(0, len(COLUMNS), self)
+        self.table.setHorizontalHeaderLabels(COLUMNS)
+        self.table.verticalHeader().hide()
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.table.horizontalHeader().setSectionResizeMode(0, QtWidgets.QHeaderView.Stretch)
+        layout.addWidget(self.table)
+
+        buttons = QtWidgets.QHBoxLayout()
+        self.record_button = QtWidgets.QPushButton('Record Trace', self)
+        self.record_button.setCheckable(True)
+        self.record_button.toggled.connect(self.record_toggled)
+        self.reset_button = QtWidgets.QPushButton('Reset', self)
+        self.reset_button.clicked.connect(self.reset)
+        buttons.addWidget(self.record_button)
+        buttons.addWidget(self.reset_button)
+        layout.addLayout(buttons)
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(1000)
+        self.timer.timeout.connect(self.refresh)
+
+    def showEvent(self, event):
+        self.refresh()
+        self.timer.start()
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
+
+    def refresh(self):
+        rows = self.profiler.stats()
+        self.table.setRowCount(len(rows))
+        for i, row in enumerate(rows):
+            values = (row['name'], str(row['count']), f"{row['mean'] * 1000:.2f}", f"{row['max'] * 1000:.2f}",
+                      f"{row['last'] * 1000:.2f}", f"{row['rss_mb']:.1f}", f"{row['allocated'] / (1024 * 1024):.1f}")
+            for column, value in enumerate(values):
+                item = QtWidgets.QTableWidgetItem(value)
+                if column:
+                    item.setTextAlignment(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
+                self.table.setItem(i, column, item)
+
+    def record_toggled(self, checked):
+        if checked:
+            self.record_button.setText('Stop and Save Trace')
+            self.profiler.start_recording()
+            return
+        self.record_button.setText('Record Trace')
+        spans = self.profiler.stop_recording()
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Save Chrome Trace", "trace.json", "JSON (*.json)")
+        if path:
+            count = self.profiler.dump_chrome_trace(path, spans)
+            print(f'Saved {count} trace events to {path}')
+
+    def reset(self):
+        self.profiler.clear()
+        self.refresh()
@@ -0,0 +1,105 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Volume axis each viewer orientation slices along
+ORIENTATION_AXES = {'axial': 2, 'sagittal': 1, 'coronal': 0}
+
+
+def slice_view(volume, orientation, index):
+    # Display orientation of the viewer, sagittal and coronal slices are flipped along their second axis
+    if orientation == 'axial':
+        return volume[:, :, index]
+    elif orientation == 'sagittal':
+        return volume[:, index, :][:, ::-1]
+    elif orientation == 'coronal':
+        return volume[index, :, :][:, ::-1]
+    raise ValueError(f"Unknown orientation: {orientation}")
+
+
+def slice_count(volume, orientation):
+    return volume.shape[ORIENTATION_AXES[orientation]]
+
+
+def display_rect(shape, orientation, index, region):
+    # Rectangle of the displayed slice covered by a volume region, None when the slice is outside the region
+    axis = ORIENTATION_AXES[orientation]
+    if not region[axis].start <= index < region[axis].stop:
+        return None
+    rows, columns = [region[a] for a in range(3) if a != axis]
+    if orientation != 'axial':
+        depth = shape[2]
+        columns = slice(depth - columns.stop, depth - columns.start)
+    return rows, columns
+
+
+def slice_region(volume, orientation, index, region):
+    # slice_view(volume, orientation, index)[display_rect(...)] without reading the rest of the slice
+    key = list(region)
+    key[ORIENTATION_AXES[orientation]] = index
+    values = volume[tuple(key)]
+    return values if orientation == 'axial' else values[:, ::-1]
+
+
+class SliceCache(object):
+    # Contiguous, display-ready slices of a volume with one LRU per orientation.
+    # prefetch() reads the next slices in the scroll direction on a background thread.
+    def __init__(self, volume, capacity=64, prefetch=8):
+        self.volume = volume
+        self.capacity = capacity
+        self.prefetch_count = prefetch
+        self.slices = {'axial': OrderedDict(), 'sagittal': OrderedDict(), 'coronal': OrderedDict()}
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        self.pending = None
+
+    def get(self, orientation, index):
+        cached = self.lookup(orientation, index)
+        if cached is None:
+            cached = self.store(orientation, index, np.ascontiguousarray(slice_view(self.volume, orientation, index)))
+        return cached
+
+    def lookup(self, orientation, index):
+        with self.lock:
+            cache = self.slices[orientation]
+            if index in cache:
+                cache.move_to_end(index)
+                return cache[index]
+        return None
+
+    def store(self, orientation, index, image_slice):
+        with self.lock:
+            cache = self.slices[orientation]
+            cache[index] = image_slice
+            cache.move_to_end(index)
+            while len(cache) > self.capacity:
+                cache.popitem(last=False)
+        return image_slice
+
+    def prefetch(self, orientation, index, direction):
+        # Only the latest scroll position is worth reading ahead for, older requests are dropped
+        if direction == 0 or self.prefetch_count == 0:
+            return
+        if self.pending is not None:
+            self.pending.cancel()
+        step = 1 if direction > 0 else -1
+        stop = slice_count(self.volume, orientation)
+        indices = [i for i in range(index + step, index + step * (self.prefetch_count + 1), step) if 0 <= i < stop]
+        self.pending = self.pool.submit(self.read_ahead, orientation, indices)
+
+    def read_ahead(self, orientation, indices):
+        for index in indices:
+            if self.lookup(orientation, index) is None:
+                self.store(orientation, index, np.ascontiguousarray(slice_view(self.volume, orientation, index)))
+
+    def clear(self):
+        with self.lock:
+            for cache in self.slices.values():
+                cache.clear()
+
+    def close(self):
+        if self.pending is not None:
+            self.pending.cancel()
+        self.pool.shutdown(wait=False)
@@ -0,0 +1,57 @@
+import numpy as np
+
+
+class ThresholdPreview(object):
+    # Threshold preview of the displayed slice plus voxel counts of the ROI for any threshold range.
+    # Counts come from per-slice histograms built once per ROI, so they cost two lookups per slice.
+    def __init__(self, volume, roi):
+        self.volume = volume
+        self.roi = roi
+        self.low = None
+        self.below = None
+        self.cumulative = None
+        self.mask = None
+        self.scratch = None
+
+    def build(self, progress=None):
+        cropped = self.volume[self.roi]
+        depth = cropped.shape[2]
+        low, high = int(np.floor(cropped.min())), int(np.ceil(cropped.max()))
+        floors = np.zeros((depth, high - low + 2), dtype=np.int64)
+        ceils = floors if cropped.dtype.kind != 'f' else np.zeros_like(floors)
+        for z in range(depth):
+            values = cropped[:, :, z]
+            floors[z, 1:] = np.bincount((np.floor(values).astype(np.int64) - low).ravel(), minlength=high - low + 1)
+            if ceils is not floors:
+                ceils[z, 1:] = np.bincount((np.ceil(values).astype(np.int64) - low).ravel(), minlength=high - low + 1)
+            if progress is not None:
+                progress(z + 1, depth, 'Histogram')
+        # For integer thresholds v < lo is floor(v) < lo and v <= hi is ceil(v) <= hi, integer data needs one table
+        self.low = low
+        self.below = np.cumsum(floors, axis=1)
+        self.cumulative = self.below if ceils is floors else np.cumsum(ceils, axis=1)
+        return self
+
+    @property
+    def ready(self):
+        return self.cumulative is not None
+
+    def slice_counts(self, lower_thresh, higher_thresh):
+        # Voxels of every ROI slice inside [lower_thresh, higher_thresh]
+        last = self.cumulative.shape[1] - 1
+        lower = min(max(int(lower_thresh) - self.low, 0), last)
+        upper = min(max(int(higher_thresh) - self.low + 1, 0), last)
+        return np.maximum(self.cumulative[:, upper] - self.below[:, lower], 0)
+
+    def count(self, lower_thresh, higher_thresh):
+        return int(self.slice_counts(lower_thresh, higher_thresh).sum())
+
+    def mask_slice(self, image_slice, lower_thresh, higher_thresh):
+        # Thresholded slice written into buffers reused between calls, returned as a 0/1 uint8 view
+        if self.mask is None or self.mask.shape != image_slice.shape:
+            self.mask = np.empty(image_slice.shape, dtype=bool)
+            self.scratch = np.empty(image_slice.shape, dtype=bool)
+        np.greater_equal(image_slice, lower_thresh, out=self.mask)
+        np.less_equal(image_slice, higher_thresh, out=self.scratch)
+        np.logical_and(self.mask, self.scratch, out=self.mask)
+        return self.mask.view(np.uint8)
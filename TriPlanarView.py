@@ -0,0 +1,126 @@
+import numpy as np
+import pyqtgraph as pg
+from PyQt5 import QtWidgets
+from PyQt5.QtCore import pyqtSignal
+
+from SliceCache import slice_view
+
+# Volume axis each pane slices along, named like the viewer's orientation flags
+PANE_AXES = {'axial': 2, 'sagittal': 1, 'coronal': 0}
+
+
+def overlay_lut():
+    # Mask levels drawn in green, 0 fully transparent
+    lut = np.zeros((256, 4), dtype=np.uint8)
+    lut[:, 1] = 255
+    lut[:, 3] = np.linspace(0, 160, 256).astype(np.uint8)
+    return lut
+
+
+class TriPlanarView(QtWidgets.QWidget):
+    # Axial, sagittal and coronal panes around a shared cursor. The panes display views of the volume and the
+    # mask, and only panes whose slice index changed are redrawn when the cursor moves.
+    sigCursorMoved = pyqtSignal(int, int, int)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.layout_widget = pg.GraphicsLayoutWidget(self)
+        layout = QtWidgets.QHBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.layout_widget)
+
+        self.volume = None
+        self.mask = None
+        self.levels = None
+        self.cursor = [0, 0, 0]
+        self.displayed = {}
+        self.panes = {}
+        lut = overlay_lut()
+        for column, orientation in enumerate(PANE_AXES):
+            view_box = self.layout_widget.addViewBox(row=0, col=column)
+            view_box.setAspectLocked(True)
+            view_box.invertY(True)
+            image = pg.ImageItem()
+            overlay = pg.ImageItem()
+            overlay.setLookupTable(lut)
+            overlay.setLevels((0, 255))
+            vertical = pg.InfiniteLine(angle=90, movable=False, pen=(255, 255, 0))
+            horizontal = pg.InfiniteLine(angle=0, movable=False, pen=(255, 255, 0))
+            for item in (image, overlay, vertical, horizontal):
+                view_box.addItem(item)
+            self.panes[orientation] = (view_box, image, overlay, vertical, horizontal)
+        self.layout_widget.scene().sigMouseClicked.connect(self.mouse_clicked)
+
+    def set_volume(self, volume, levels=None):
+        self.volume = volume
+        self.levels = levels
+        self.cursor = [min(c, n - 1) for c, n in zip(self.cursor, volume.shape)]
+        self.displayed = {}
+        self.redraw(self.cursor)
+
+    def set_mask(self, mask):
+        # Called after the mask was replaced or edited, every pane's overlay is read again
+        self.mask = mask
+        self.redraw_overlays()
+
+    def set_cursor(self, x, y, z):
+        self.cursor = [x, y, z]
+        self.redraw(self.cursor)
+
+    def pane_coordinates(self, orientation):
+        # Crosshair position of the cursor within a pane, sagittal and coronal panes are flipped along z
+        x, y, z = self.cursor
+        depth = self.volume.shape[2]
+        return {'axial': (x, y), 'sagittal': (x, depth - 1 - z), 'coronal': (y, depth - 1 - z)}[orientation]
+
+    def redraw(self, cursor):
+        if self.volume is None:
+            return
+        for orientation, axis in PANE_AXES.items():
+            _, image, overlay, vertical, horizontal = self.panes[orientation]
+            index = cursor[axis]
+            if self.displayed.get(orientation) != index:
+                if self.levels is None:
+                    image.setImage(slice_view(self.volume, orientation, index))
+                    self.levels = image.getLevels()
+                else:
+                    image.setImage(slice_view(self.volume, orientation, index), autoLevels=False, levels=self.levels)
+                self.displayed[orientation] = index
+                self.draw_overlay(orientation)
+            column, row = self.pane_coordinates(orientation)
+            vertical.setValue(column + 0.5)
+            horizontal.setValue(row + 0.5)
+
+    def redraw_overlays(self, region=None):
+        # Only panes showing a slice through region are read again
+        for orientation, index in self.displayed.items():
+            if region is None or region[PANE_AXES[orientation]].start <= index < region[PANE_AXES[orientation]].stop:
+                self.draw_overlay(orientation)
+
+    def draw_overlay(self, orientation):
+        overlay = self.panes[orientation][2]
+        if self.mask is None:
+            overlay.clear()
+            return
+        overlay.setImage(slice_view(self.mask, orientation, self.displayed[orientation]), autoLevels=False)
+
+    def mouse_clicked(self, event):
+        if self.volume is None:
+            return
+        depth = self.volume.shape[2]
+        for orientation, (view_box, *_) in self.panes.items():
+            if not view_box.sceneBoundingRect().contains(event.scenePos()):
+                continue
+            point = view_box.mapSceneToView(event.scenePos())
+            column, row = int(point.x()), int(point.y())
+            x, y, z = self.cursor
+            if orientation == 'axial':
+                x, y = column, row
+            elif orientation == 'sagittal':
+                x, z = column, depth - 1 - row
+            else:
+                y, z = column, depth - 1 - row
+            x, y, z = [min(max(v, 0), n - 1) for v, n in zip((x, y, z), self.volume.shape)]
+            self.set_cursor(x, y, z)
+            self.sigCursorMoved.emit(x, y, z)
+            return
@@ -56,5 +56,18 @@ class UI_VTKshower(QMainWindow):
         self.mesh_renderer.GetActiveCamera().SetViewUp(0.0, 1.0, 0.0)
         self.mesh_interactor.Render()
 
-
-
+    def render_surface(self, mesh):
+        # Surface mesh built off the GUI thread, only the mapper and actor are set up here
+        self.surface_mapper = vtk.vtkPolyDataMapper()
+        self.surface_mapper.SetInputData(mesh)
+        self.surface_mapper.ScalarVisibilityOff()
+
+        self.surface_actor = vtk.vtkActor()
+        self.surface_actor.SetMapper(self.surface_mapper)
+        self.surface_actor.GetProperty().SetColor(0.9, 0.3, 0.3)
+        self.surface_actor.GetProperty().SetSpecular(0.3)
+
+        self.mesh_renderer.AddActor(self.surface_actor)
+        self.mesh_renderer.ResetCamera()
+        self.mesh_renderer.GetActiveCamera().SetViewUp(0.0, 1.0, 0.0)
+        self.mesh_interactor.Render()
@@ -0,0 +1,144 @@
+import errno
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+
+DEFAULT_MAX_BYTES = 4 * 1024 ** 3
+
+
+def default_cache_dir():
+    return os.environ.get('CT_ANNOTATOR_CACHE', os.path.join(os.path.expanduser('~'), '.ct_annotator_cache'))
+
+
+class VolumeCache(object):
+    # Decoded series stored as .npy (opened memory-mapped) next to a .json with their metadata.
+    # Once the series in the folder take more than max_bytes the least recently used ones are removed.
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_bytes = max_bytes
+
+    def key(self, headers):
+        # Changes whenever a file of the series is added, removed, rewritten or resized
+        digest = hashlib.sha1(headers[0]['series_instance_uid'].encode())
+        for header in sorted(headers, key=lambda header: header['path']):
+            digest.update(f"{os.path.basename(header['path'])}|{header['mtime_ns']}|{header['size']}".encode())
+        return digest.hexdigest()
+
+    def paths(self, key):
+        return os.path.join(self.cache_dir, key + '.npy'), os.path.join(self.cache_dir, key + '.json')
+
+    def load(self, key):
+        volume_path, metadata_path = self.paths(key)
+        if not (os.path.exists(volume_path) and os.path.exists(metadata_path)):
+            return None
+        try:
+            with open(metadata_path) as f:
+                metadata = json.load(f)
+            buffer = np.load(volume_path, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        try:
+            # The modification time is the last use, the eviction order
+            os.utime(volume_path)
+        except OSError:
+            pass
+        for name in ('image_position_patient', 'pixel_spacing', 'image_orientation', 'shape'):
+            metadata[name] = tuple(metadata[name])
+        return buffer, metadata
+
+    def create(self, key, shape, dtype):
+        # Writable memory-mapped .npy the series is decoded into, so it never has to fit in RAM. The space is
+        # reserved up front, a full disk would otherwise only show up as a crash while the slices are written.
+        os.makedirs(self.cache_dir, exist_ok=True)
+        volume_path, _ = self.paths(key)
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if shutil.disk_usage(self.cache_dir).free < nbytes:
+            raise OSError(errno.ENOSPC, "Not enough space for the series", self.cache_dir)
+        buffer = np.lib.format.open_memmap(volume_path + '.tmp.npy', mode='w+', dtype=dtype, shape=shape)
+        if hasattr(os, 'posix_fallocate'):
+            try:
+                with open(volume_path + '.tmp.npy', 'r+b') as f:
+                    os.posix_fallocate(f.fileno(), 0, os.fstat(f.fileno()).st_size)
+            except OSError as error:
+                if error.errno not in (errno.EINVAL, errno.EOPNOTSUPP):
+                    del buffer
+                    self.discard(key)
+                    raise
+        return buffer
+
+    def commit(self, key, metadata):
+        # The volume is written under a temporary name first so an interrupted load is never picked up.
+        # Only the metadata write can fail for lack of space, the volume is then still in its temporary file.
+        volume_path, metadata_path = self.paths(key)
+        try:
+            with open(metadata_path + '.tmp', 'w') as f:
+                json.dump(metadata, f)
+        except OSError:
+            if os.path.exists(metadata_path + '.tmp'):
+                os.remove(metadata_path + '.tmp')
+            raise
+        os.replace(volume_path + '.tmp.npy', volume_path)
+        os.replace(metadata_path + '.tmp', metadata_path)
+        self.evict(keep=key)
+
+    def read_pending(self, key):
+        # Decoded volume of a series that could not be committed, read into memory before its file is removed
+        volume_path, _ = self.paths(key)
+        buffer = np.load(volume_path + '.tmp.npy')
+        self.discard(key)
+        return buffer
+
+    def discard(self, key):
+        volume_path, metadata_path = self.paths(key)
+        for path in (volume_path + '.tmp.npy', metadata_path + '.tmp'):
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def entries(self):
+        # (last use, bytes, key) of every complete series in the folder, oldest first
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+        for name in os.listdir(self.cache_dir):
+            key, extension = os.path.splitext(name)
+            if extension != '.npy' or key.endswith('.tmp'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                size = stat.st_size + os.path.getsize(self.paths(key)[1])
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, size, key))
+        return sorted(entries)
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, keep=None):
+        # The series just loaded is kept even when it is larger than the budget on its own, it is still mapped
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            try:
+                for path in self.paths(key):
+                    os.remove(path)
+            except OSError:
+                # Still mapped by a running load on Windows, tried again after the next commit
+                continue
+            total -= size
+        return total
+
+    def set_max_bytes(self, max_bytes):
+        self.max_bytes = max_bytes
+        return self.evict()
@@ -0,0 +1,62 @@
+import threading
+import traceback
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+from Profiler import span
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobSignals(QObject):
+    progress = pyqtSignal(int, int, str)
+    finished = pyqtSignal(object)
+    cancelled = pyqtSignal()
+    failed = pyqtSignal(str)
+
+
+class ComputeJob(QRunnable):
+    # Runs func(*args, progress=..., **kwargs) on a thread pool and reports back through Qt signals.
+    # func calls progress(done, total, stage) between steps, which raises JobCancelled once cancel() was called.
+    def __init__(self, func, *args, on_cancel=None, **kwargs):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.on_cancel = on_cancel
+        self.cancel_event = threading.Event()
+        self.signals = JobSignals()
+
+    def report(self, done, total, stage=''):
+        if self.cancel_event.is_set():
+            raise JobCancelled(stage)
+        self.signals.progress.emit(done, total, stage)
+
+    def run(self):
+        try:
+            with span(f"ComputeJob({getattr(self.func, '__qualname__', repr(self.func))})", 'job') as job_span:
+                result = self.func(*self.args, progress=self.report, **self.kwargs)
+                if job_span is not None:
+                    job_span.allocate(result)
+        except Exception as error:
+            if self.cancel_event.is_set():
+                self.signals.cancelled.emit()
+            else:
+                traceback.print_exc()
+                self.signals.failed.emit(str(error))
+        else:
+            if self.cancel_event.is_set():
+                self.signals.cancelled.emit()
+            else:
+                self.signals.finished.emit(result)
+
+    def cancel(self):
+        self.cancel_event.set()
+        if self.on_cancel is not None:
+            self.on_cancel()
+
+    def start(self, pool=None):
+        (pool or QThreadPool.globalInstance()).start(self)
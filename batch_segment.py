@@ -0,0 +1,150 @@
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from Calculator import Calculator
+from DicomLoader import DicomSeriesLoader
+from Exporters import EXPORTERS
+from LabelMap import LabelMap
+from Profiler import PROFILER, max_rss_mb
+from VolumeCache import VolumeCache
+
+# Headless version of the load -> ROI -> threshold -> save steps of CTReaderApp, no PyQt or VTK is imported
+
+
+def resolve_roi(roi, shape):
+    # None keeps the whole axis, negative bounds count from the end like Python slices
+    bounds = []
+    for (start, stop), n in zip(roi or [(None, None)] * 3, shape):
+        start, stop, _ = slice(start, stop).indices(n)
+        bounds.extend((start, stop))
+    return bounds
+
+
+def segment_series(job):
+    timings = {}
+    report = {'series': job['path'], 'status': 'ok'}
+    if job.get('trace'):
+        PROFILER.start_recording()
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    try:
+        cache = VolumeCache(job['cache_dir'], int(job.get('cache_gb', 4) * 1024 ** 3)) if job.get('cache_dir') else None
+        loader = DicomSeriesLoader(job['path'], max_workers=job.get('io_workers'), cache=cache)
+        data, metadata = loader.load()
+        timings['load'] = time.perf_counter() - start_time
+
+        x_min, x_max, y_min, y_max, z_min, z_max = resolve_roi(job.get('roi'), data.shape)
+        lower_thresh, higher_thresh = job['threshold']
+        calculator = Calculator()
+        mask = calculator.confrim_threshold(data, x_min, x_max, y_min, y_max, z_min, z_max, lower_thresh, higher_thresh, 0,
+                                            job.get('k'), job.get('min_size', 0), job.get('connectivity', 6), max_workers=job.get('threads', 1))
+        timings['segment'] = time.perf_counter() - start_time - timings['load']
+
+        # Same volume create_final_image hands to convert_to_original_coordinates for a single stored structure
+        label_map = LabelMap(data.shape)
+        label_map.add(mask)
+        exporter = EXPORTERS[job.get('format', 'dicom')]
+        output_path = exporter.output_path(job['output'], f"{os.path.basename(os.path.normpath(job['path']))}_{time.strftime('%Y%m%d')}")
+        exporter.export(label_map.data, output_path, metadata)
+        timings['write'] = time.perf_counter() - start_time - timings['load'] - timings['segment']
+
+        report.update(output=output_path, shape=list(data.shape), roi=[x_min, x_max, y_min, y_max, z_min, z_max],
+                      mask_voxels=mask.count_nonzero())
+    except Exception as error:
+        report.update(status='failed', error=f"{type(error).__name__}: {error}")
+    report['seconds'] = {name: round(value, 3) for name, value in timings.items()}
+    report['seconds']['total'] = round(time.perf_counter() - start_time, 3)
+    report['peak_traced_mb'] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1)
+    report['max_rss_mb'] = round(max_rss_mb(), 1)
+    report['pid'] = os.getpid()
+    tracemalloc.stop()
+    if job.get('trace'):
+        report['trace_events'] = PROFILER.trace_events(PROFILER.stop_recording())
+    return report
+
+
+def build_jobs(args):
+    defaults = {
+        'output': args.output,
+        'threshold': args.threshold,
+        'roi': [tuple(args.roi[i:i + 2]) for i in range(0, 6, 2)] if args.roi else None,
+        'k': args.k,
+        'min_size': args.min_size,
+        'connectivity': args.connectivity,
+        'cache_dir': args.cache,
+        'cache_gb': args.cache_gb,
+        'io_workers': args.io_workers,
+        'threads': args.threads,
+        'format': args.format,
+        'trace': args.trace is not None,
+    }
+    jobs = [dict(defaults, path=path) for path in args.series]
+    if args.manifest:
+        # List of {"path": ..., and any of the options above} overriding the command line per series
+        with open(args.manifest) as f:
+            jobs.extend(dict(defaults, **entry) for entry in json.load(f))
+    for job in jobs:
+        if job['threshold'] is None:
+            raise SystemExit(f"No threshold given for {job['path']}")
+    return jobs
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Segment DICOM series without the GUI and save the masks as DICOM slices.")
+    parser.add_argument('series', nargs='*', help="folders holding one DICOM series each")
+    parser.add_argument('-o', '--output', required=True, help="folder the <series>_<date> masks are written to")
+    parser.add_argument('-t', '--threshold', type=float, nargs=2, metavar=('LOWER', 'UPPER'))
+    parser.add_argument('--roi', type=int, nargs=6, metavar=('X_MIN', 'X_MAX', 'Y_MIN', 'Y_MAX', 'Z_MIN', 'Z_MAX'),
+                        help="voxel bounds as on the ROI sliders, the whole volume by default")
+    parser.add_argument('-k', type=int, default=None, help="components kept, 3 by default")
+    parser.add_argument('--min-size', type=int, default=0)
+    parser.add_argument('--connectivity', type=int, choices=(6, 26), default=6)
+    parser.add_argument('-f', '--format', choices=list(EXPORTERS), default='dicom', help="mask format, DICOM slices as in the app by default")
+    parser.add_argument('--manifest', help="JSON list of per-series settings")
+    parser.add_argument('-j', '--workers', type=int, default=None, help="series processed at once, one process each")
+    parser.add_argument('--threads', type=int, default=1, help="threads of the chunked pipeline inside each process")
+    parser.add_argument('--io-workers', type=int, default=4, help="threads decoding slices inside each process")
+    parser.add_argument('--cache', default=None, help="volume cache folder, not used by default")
+    parser.add_argument('--cache-gb', type=float, default=4, help="size the cache folder is trimmed to, least recently used series first")
+    parser.add_argument('--report', default=None, help="JSON report path, <output>/batch_report.json by default")
+    parser.add_argument('--trace', default=None, help="Chrome trace JSON of every series' stages, not written by default")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    jobs = build_jobs(args)
+    if not jobs:
+        raise SystemExit("No series given")
+    os.makedirs(args.output, exist_ok=True)
+
+    reports = []
+    trace_events = []
+    start_time = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(segment_series, job) for job in jobs]
+        for done, future in enumerate(as_completed(futures), start=1):
+            report = future.result()
+            trace_events.extend(report.pop('trace_events', []))
+            reports.append(report)
+            seconds = report['seconds']
+            print(f"[{done}/{len(jobs)}] {report['status']:<6} {report['series']} "
+                  f"{seconds['total']:.1f}s peak {report['peak_traced_mb']:.0f} MB" + (f" {report['error']}" if 'error' in report else ''))
+
+    report_path = args.report or os.path.join(args.output, 'batch_report.json')
+    with open(report_path, 'w') as f:
+        json.dump({'wall_seconds': round(time.perf_counter() - start_time, 3), 'series': reports}, f, indent=2)
+    print(f"Report saved in: {report_path}")
+    if args.trace:
+        PROFILER.dump_chrome_trace(args.trace, [], trace_events)
+        print(f"Trace saved in: {args.trace}")
+    return 0 if all(report['status'] == 'ok' for report in reports) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
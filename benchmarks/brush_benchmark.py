@@ -0,0 +1,74 @@
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Calculator import Calculator
+from MaskVolume import MASK_LEVEL
+
+
+# Per-voxel loop erase_or_draw used before the vectorized brush (axial, draw only)
+def loop_draw(size, x_index, y_index, z_index, data, threshold_min, threshold_max, original_image, checked, mult_sliced_checked):
+    for x in range(x_index - size + 1, x_index + size):
+        for y in range(y_index - size + 1, y_index + size):
+            for z in range(z_index - size + 1, z_index + size):
+                pixel_value = original_image[x, y, z]
+                if checked == 1 and not (threshold_min - 150) <= pixel_value <= (threshold_max + 150):
+                    continue
+                target_z = z if mult_sliced_checked == 1 else z_index
+                data[x, y, target_z] = MASK_LEVEL
+
+
+def make_volume(shape, seed=0):
+    rng = np.random.default_rng(seed)
+    original_image = rng.integers(-1000, 1500, size=shape).astype(np.int16)
+    filter_volume = np.zeros(shape, dtype=np.uint8)
+    return original_image, filter_volume
+
+
+def best_of(func, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start_time)
+    return best
+
+
+def main():
+    calculator = Calculator()
+    shape = (128, 128, 128)
+    center = (64, 64, 64)
+    threshold_min, threshold_max = 200, 600
+
+    print(f"{'size':>5} {'voxels':>8} {'loop (ms)':>12} {'vector (ms)':>12} {'speedup':>9}")
+    for size in (1, 3, 5, 10, 20):
+        original_image, loop_mask = make_volume(shape)
+        _, vector_mask = make_volume(shape)
+
+        loop_time = best_of(lambda: loop_draw(size, *center, loop_mask, threshold_min, threshold_max, original_image, 1, 1), 3 if size < 10 else 1)
+        vector_time = best_of(lambda: calculator.erase_or_draw(size, *center, vector_mask, threshold_min, threshold_max, False, True, original_image, 1, 0, 0, 1, 1), 20)
+
+        assert np.array_equal(loop_mask, vector_mask)
+        voxels = (2 * size - 1) ** 3
+        print(f"{size:>5} {voxels:>8} {loop_time * 1000:>12.2f} {vector_time * 1000:>12.3f} {loop_time / vector_time:>8.1f}x")
+
+    # A drag across the slice: one brush stamp per path voxel against the whole stroke in one edit
+    samples = [(20, 20, 64), (60, 40, 64), (100, 90, 64), (108, 30, 64)]
+    print(f"\n{'size':>5} {'shape':>7} {'path':>6} {'stamps (ms)':>12} {'stroke (ms)':>12} {'speedup':>9}")
+    for size in (3, 10, 20):
+        for brush_shape in ('cube', 'sphere'):
+            original_image, stamp_mask = make_volume(shape)
+            _, stroke_mask = make_volume(shape)
+            path = calculator.stroke_path(samples)
+            stamp_args = (stamp_mask, threshold_min, threshold_max, False, True, original_image, 1, 0, 0, 0, 1, brush_shape)
+            stamp_time = best_of(lambda: [calculator.erase_or_draw(size, *point, *stamp_args) for point in path], 3)
+            stroke_time = best_of(lambda: calculator.erase_or_draw_stroke(size, samples, stroke_mask, threshold_min, threshold_max, False, True, original_image, 1, 0, 0, 0, 1, brush_shape), 10)
+
+            assert np.array_equal(stamp_mask, stroke_mask)
+            print(f"{size:>5} {brush_shape:>7} {len(path):>6} {stamp_time * 1000:>12.2f} {stroke_time * 1000:>12.3f} {stamp_time / stroke_time:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
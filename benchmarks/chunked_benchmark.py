@@ -0,0 +1,49 @@
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Calculator import Calculator
+from ChunkedPipeline import ChunkedPipeline
+from threshold_benchmark import make_roi
+
+
+def check_identical(calculator, shape, lower_thresh, higher_thresh, k, min_size, connectivity):
+    # The chunked pipeline has to give exactly the serial mask, whatever the chunking
+    roi = make_roi(shape)
+    serial = calculator.confrim_threshold(roi, 0, shape[0], 0, shape[1], 0, shape[2], lower_thresh, higher_thresh, 0, k, min_size, connectivity)
+    for workers, chunks in ((2, None), (4, None), (3, shape[2]), (4, 7)):
+        levels = ChunkedPipeline(calculator, workers, chunks).run(roi, lower_thresh, higher_thresh, k, min_size, connectivity)
+        assert np.array_equal(serial.data, levels), (shape, k, min_size, connectivity, workers, chunks)
+
+
+def main():
+    calculator = Calculator()
+    for connectivity in (6, 26):
+        for k, min_size in ((1, 0), (3, 0), (7, 50), (100, 0)):
+            for lower_thresh in (100, 300):
+                check_identical(calculator, (64, 64, 40), lower_thresh, 700, k, min_size, connectivity)
+    print("Chunked masks identical to the serial path")
+
+    shape = tuple(int(v) for v in sys.argv[1:4]) if len(sys.argv) > 3 else (256, 256, 300)
+    roi = make_roi(shape)
+    start_time = time.perf_counter()
+    serial = calculator.confrim_threshold(roi, 0, shape[0], 0, shape[1], 0, shape[2], 300, 700, 0)
+    serial_time = time.perf_counter() - start_time
+
+    print(f"ROI {shape}, {os.cpu_count()} cores")
+    print(f"{'workers':>8} {'seconds':>9} {'speedup':>9}")
+    print(f"{'serial':>8} {serial_time:>9.3f} {1:>8.1f}x")
+    workers = 1
+    while workers <= (os.cpu_count() or 1):
+        start_time = time.perf_counter()
+        levels = ChunkedPipeline(calculator, workers).run(roi, 300, 700, 3)
+        elapsed = time.perf_counter() - start_time
+        assert np.array_equal(serial.data, levels)
+        print(f"{workers:>8} {elapsed:>9.3f} {serial_time / elapsed:>8.1f}x")
+        workers *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import SimpleITK as sitk
+import vtkmodules.all as vtk
+from vtk.util import numpy_support
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from DicomLoader import DicomSeriesLoader
+
+
+def write_series(output_dir, slices=200, size=512, seed=0):
+    # Synthetic CT series with shuffled file names, one file per slice
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(slices)
+    for file_index, k in enumerate(order):
+        pixels = rng.integers(0, 2000, size=(size, size)).astype(np.int16)
+        image = sitk.GetImageFromArray(pixels)
+        image.SetSpacing((0.5, 0.5))
+        image.SetMetaData("0008|0060", "CT")
+        image.SetMetaData("0020|000e", "1.2.826.0.1.3680043.8.498.1")
+        image.SetMetaData("0020|0013", str(k))
+        image.SetMetaData("0020|0032", f"-125\\-125\\{k * 0.625}")
+        image.SetMetaData("0020|0037", "1\\0\\0\\0\\1\\0")
+        image.SetMetaData("0018|0050", "0.625")
+        image.SetMetaData("0028|1052", "-1024")
+        image.SetMetaData("0028|1053", "1")
+        writer = sitk.ImageFileWriter()
+        writer.KeepOriginalImageUIDOn()
+        writer.SetFileName(os.path.join(output_dir, f"IM{file_index:05d}.dcm"))
+        writer.Execute(image)
+
+
+# Synchronous path used by CTReaderApp.dicom_reader before the threaded loader
+def vtk_reader(data_path):
+    reader = vtk.vtkDICOMImageReader()
+    reader.SetDirectoryName(data_path)
+    reader.Update()
+
+    _extent = reader.GetDataExtent()
+    ConstPixelDims = [_extent[1]-_extent[0]+1, _extent[3]-_extent[2]+1, _extent[5]-_extent[4]+1]
+    arrayData = reader.GetOutput().GetPointData().GetArray(0)
+    ArrayDicom = numpy_support.vtk_to_numpy(arrayData).reshape(ConstPixelDims, order='F')
+    data = ArrayDicom[:, ::-1, ::-1]
+
+    dicom_files = [os.path.join(data_path, f) for f in os.listdir(data_path)]
+    ds = sitk.ReadImage(dicom_files[0])
+    slice_thickness = float(ds.GetMetaData('0018|0050'))
+    return data.copy(), slice_thickness
+
+
+def main():
+    slices = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    with tempfile.TemporaryDirectory() as data_path:
+        write_series(data_path, slices)
+
+        start_time = time.perf_counter()
+        vtk_data, _ = vtk_reader(data_path)
+        vtk_time = time.perf_counter() - start_time
+        print(f"VTK reader: {vtk_time:.3f} seconds")
+
+        for workers in (1, 4, None):
+            loader = DicomSeriesLoader(data_path, max_workers=workers)
+            start_time = time.perf_counter()
+            data, metadata = loader.load()
+            loader_time = time.perf_counter() - start_time
+            assert np.array_equal(data, vtk_data)
+            print(f"Threaded loader ({loader.max_workers} workers): {loader_time:.3f} seconds, {vtk_time / loader_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import os
+import sys
+import tempfile
+import time
+import warnings
+import numpy as np
+import pydicom
+import SimpleITK as sitk
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Exporters import write_dicom_slices
+
+
+# Serial writer of CTReaderApp.convert_to_original_coordinates before the streaming one
+def serial_writer(array, subdirectory, spacing, origin, thickness):
+    series_uid = "A"
+    study_uid = 'B'
+    array = array[::-1, :, :]
+    array = np.rot90(array, k=-1, axes=(0, 1))
+    array = np.transpose(array, axes=(2, 0, 1))
+
+    new_img = sitk.GetImageFromArray(array)
+    new_img.SetSpacing([spacing[0], spacing[1], thickness])
+    new_img.SetOrigin((origin[0], origin[1], origin[2]))
+    os.makedirs(subdirectory, exist_ok=True)
+
+    writer = sitk.ImageFileWriter()
+    writer.KeepOriginalImageUIDOn()
+    for i in range(array.shape[0]):
+        image_slice = new_img[:, :, i]
+        image_slice = sitk.Cast(image_slice, sitk.sitkUInt16)
+        image_slice.SetMetaData("0010|0010", "Output Patient")
+        image_slice.SetMetaData("0010|0020", "CT_vessl")
+        image_slice.SetMetaData("0020|000d", study_uid)
+        image_slice.SetMetaData("0020|000e", series_uid)
+        image_slice.SetMetaData("0008|0020", time.strftime("%Y%m%d"))
+        image_slice.SetMetaData("0008|0030", time.strftime("%H%M%S"))
+        image_slice.SetMetaData("0018|0088", str(thickness))
+        image_slice.SetMetaData("0018|9306", str(thickness))
+        image_slice.SetMetaData("0028|0030", f"{spacing[0]}\\{spacing[1]}")
+        image_slice.SetMetaData("0020|0032", f"{origin[0]}\\{origin[1]}\\{origin[2] + i*thickness}")
+        image_slice.SetMetaData("0018|0050", str(thickness))
+        image_slice.SetMetaData("0018|103e", 'CoW')
+        image_slice.SetMetaData("0020|0052", series_uid)
+        image_slice.SetMetaData("0008|0012", time.strftime("%Y%m%d"))
+        image_slice.SetMetaData("0008|0013", time.strftime("%H%M%S"))
+        image_slice.SetMetaData("0008|0060", "CT")
+        image_slice.SetMetaData("0020|0037", "1.000000\\0.000000\\0.000000\\0.000000\\1.000000\\0.000000")
+        image_slice.SetMetaData("0020|0013", str(i))
+        writer.SetFileName(os.path.join(subdirectory, f"{str(i)}.dcm"))
+        writer.Execute(image_slice)
+
+
+def same_files(first_dir, second_dir, depth):
+    # Pixels and tags have to match, apart from the generated instance UIDs and the write times
+    ignored = {'SOPInstanceUID', 'MediaStorageSOPInstanceUID', 'InstanceCreationTime', 'ContentTime', 'StudyTime', 'SeriesTime',
+               'InstanceCreationDate', 'ContentDate', 'StudyDate', 'SeriesDate', 'FrameOfReferenceUID'}
+    for i in range(0, depth, max(1, depth // 20)):
+        first = pydicom.dcmread(os.path.join(first_dir, f"{i}.dcm"))
+        second = pydicom.dcmread(os.path.join(second_dir, f"{i}.dcm"))
+        if not np.array_equal(first.pixel_array, second.pixel_array):
+            return False
+        for element in first:
+            if element.keyword not in ignored and element.keyword != 'PixelData' and element.value != second.get(element.tag, element).value:
+                return False
+    return True
+
+
+def main():
+    # The app writes placeholder UIDs ("A", "B"), pydicom warns about them on every read
+    warnings.filterwarnings('ignore', message='Invalid value for VR UI')
+    slices = int(sys.argv[1]) if len(sys.argv) > 1 else 600
+    rng = np.random.default_rng(0)
+    mask = np.zeros((512, 512, slices), dtype=np.int64)
+    mask[200:300, 150:260, :] = rng.integers(0, 101, size=(100, 110, slices))
+    spacing, origin, thickness = (0.5, 0.5, 0.625), (-125.0, -125.0, 0.0), 0.625
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        start_time = time.perf_counter()
+        serial_writer(mask, os.path.join(output_dir, 'serial'), spacing, origin, thickness)
+        serial_time = time.perf_counter() - start_time
+        print(f"Serial writer: {serial_time:.3f} seconds for {slices} slices")
+
+        for workers in (1, 4, None):
+            subdirectory = os.path.join(output_dir, f"streaming_{workers}")
+            start_time = time.perf_counter()
+            write_dicom_slices(mask, subdirectory, spacing, origin, thickness, max_workers=workers)
+            elapsed = time.perf_counter() - start_time
+            assert same_files(os.path.join(output_dir, 'serial'), subdirectory, slices)
+            print(f"Streaming writer ({workers or 'default'} workers): {elapsed:.3f} seconds, {serial_time / elapsed:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
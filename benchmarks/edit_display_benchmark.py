@@ -0,0 +1,57 @@
+import os
+import sys
+import time
+import numpy as np
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pyqtgraph as pg
+from PyQt5.QtWidgets import QApplication
+
+from Calculator import Calculator
+from SliceCache import display_rect, slice_region
+from brush_benchmark import best_of
+
+
+# Redrawing after an edit as update_slice did before: composite the whole slice and set it on the view
+def full_update(image_view, calculator, original_image, mask, z):
+    image_view.setImage(calculator.composite_slice(original_image[:, :, z], mask[:, :, z]))
+    image_view.setLevels(-2048, 3071)
+    image_view.getImageItem().render()
+
+
+# Patching the changed rectangle of the displayed composite like CTReaderApp.repaint_region
+def patch_update(image_view, calculator, original_image, mask, z, region):
+    image_item = image_view.getImageItem()
+    image = image_item.image
+    image[display_rect(original_image.shape, 'axial', z, region)] = calculator.composite_slice(
+        slice_region(original_image, 'axial', z, region), slice_region(mask, 'axial', z, region))
+    image_item.blockSignals(True)
+    image_item.updateImage(image, autoLevels=False)
+    image_item.blockSignals(False)
+    image_item.render()
+
+
+def main():
+    app = QApplication([])
+    calculator = Calculator()
+    image_view = pg.ImageView()
+    rng = np.random.default_rng(0)
+    z = 2
+
+    print(f"{'slice':>10} {'full (ms)':>10} {'patch (ms)':>11}")
+    for side in (256, 512, 1024, 2048):
+        original_image = rng.integers(-1000, 1500, size=(side, side, 5)).astype(np.int16)
+        mask = np.zeros(original_image.shape, dtype=np.uint8)
+        change = calculator.erase_or_draw(5, side // 2, side // 2, z, mask, 0, 0, False, True, original_image, 1, 0, 0, 0, 0)
+
+        full_time = best_of(lambda: full_update(image_view, calculator, original_image, mask, z), 5)
+        patch_time = best_of(lambda: patch_update(image_view, calculator, original_image, mask, z, change["bbox"]), 20)
+
+        expected = calculator.composite_slice(original_image[:, :, z], mask[:, :, z])
+        assert np.array_equal(image_view.getImageItem().image, expected)
+        print(f"{side:>4}x{side:<5} {full_time * 1000:>10.2f} {patch_time * 1000:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
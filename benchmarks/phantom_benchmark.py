@@ -0,0 +1,250 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import scipy
+import SimpleITK as sitk
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Calculator import Calculator
+from DicomLoader import DicomSeriesLoader
+from Exporters import EXPORTERS
+from LabelMap import LabelMap
+from MaskVolume import MaskVolume
+from Profiler import PROFILER, max_rss_mb
+from phantoms import PHANTOM_SIZES, make_phantom, vessel_seed
+
+# Headless timings of the Calculator, loader and exporters on synthetic CTA phantoms, saved as JSON so runs
+# on different commits can be compared with --compare. Nothing here imports PyQt or VTK.
+
+THRESHOLD = (220, 650)
+BRUSH_SIZES = (1, 3, 5, 10, 20)
+
+
+def traced_peak(func):
+    # Peak of the allocations traced during one run, numpy arrays included
+    tracemalloc.start()
+    try:
+        result = func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return round(peak / (1024 * 1024), 1), result
+
+
+def measure(func, repeats=1, memory=True):
+    # Best wall time over repeats, then one more run under tracemalloc, which slows it down, for the peak memory
+    seconds = float('inf')
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        result = func()
+        seconds = min(seconds, time.perf_counter() - start_time)
+    entry = {'seconds': round(seconds, 6)}
+    if memory:
+        del result
+        entry['peak_mb'], result = traced_peak(func)
+    return entry, result
+
+
+def stage_seconds(spans):
+    stages = {}
+    for span in spans:
+        stages[span.name] = round(stages.get(span.name, 0.0) + span.duration, 4)
+    return stages
+
+
+def write_series(volume, output_dir, spacing=(0.5, 0.5, 0.625)):
+    # One CT file per slice, HU stored as signed pixels (GDCM rewrites the rescale tags of int16 images)
+    for k in range(volume.shape[2]):
+        image = sitk.GetImageFromArray(np.ascontiguousarray(volume[:, :, k].T))
+        image.SetSpacing(spacing[:2])
+        image.SetMetaData("0008|0060", "CT")
+        image.SetMetaData("0020|000e", "1.2.826.0.1.3680043.8.498.2")
+        image.SetMetaData("0020|0013", str(k))
+        image.SetMetaData("0020|0032", f"-125\\-125\\{k * spacing[2]}")
+        image.SetMetaData("0020|0037", "1\\0\\0\\0\\1\\0")
+        image.SetMetaData("0018|0050", str(spacing[2]))
+        writer = sitk.ImageFileWriter()
+        writer.KeepOriginalImageUIDOn()
+        writer.SetFileName(os.path.join(output_dir, f"IM{k:05d}.dcm"))
+        writer.Execute(image)
+
+
+def directory_bytes(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+
+def bench_threshold(calculator, volume, args):
+    nx, ny, nz = volume.shape
+    run = lambda: calculator.confrim_threshold(volume, 0, nx, 0, ny, 0, nz, *THRESHOLD, 0, max_workers=args.threads)
+    PROFILER.start_recording()
+    entry, mask = measure(run, memory=False)
+    entry['stages'] = stage_seconds(PROFILER.stop_recording())
+    if args.memory:
+        del mask
+        entry['peak_mb'], mask = traced_peak(run)
+    entry['mask_voxels'] = mask.count_nonzero()
+    return entry, mask
+
+
+def bench_brush(calculator, volume, seed, args):
+    entries = []
+    x, y, z = seed
+    path = [(x - 30, y - 20, z), (x, y, z), (x + 30, y + 10, z)]
+    for size in BRUSH_SIZES:
+        mask = MaskVolume(volume.shape)
+        click, _ = measure(lambda: calculator.erase_or_draw(size, x, y, z, mask, *THRESHOLD, False, True, volume, 1, 0, 0, 1, 1),
+                           args.repeats, args.memory)
+        stroke, _ = measure(lambda: calculator.erase_or_draw_stroke(size, path, mask, *THRESHOLD, False, True, volume, 1, 0, 0, 1, 0),
+                            args.repeats, args.memory)
+        entries.append({'size': size, 'click': click, 'stroke': stroke})
+    return entries
+
+
+def bench_grow(calculator, volume, seed, args):
+    def grow():
+        mask = MaskVolume(volume.shape)
+        calculator.grow_from_seeds(*seed, volume, mask, *THRESHOLD)
+        return mask.count_nonzero()
+    entry, voxels = measure(grow, args.repeats, args.memory)
+    entry['voxels'] = voxels
+    return entry
+
+
+def bench_dicom_read(volume, work_dir, args):
+    series_dir = os.path.join(work_dir, 'series')
+    os.makedirs(series_dir)
+    start_time = time.perf_counter()
+    write_series(volume, series_dir)
+    write_seconds = time.perf_counter() - start_time
+
+    entry, (data, _) = measure(lambda: DicomSeriesLoader(series_dir, max_workers=args.io_workers).load(), 1, args.memory)
+    assert np.array_equal(data, volume), "Loaded series differs from the phantom"
+    entry.update(slices=volume.shape[2], write_seconds=round(write_seconds, 4), bytes=directory_bytes(series_dir))
+    return entry
+
+
+def bench_export(mask, metadata, work_dir, args):
+    # What create_final_image hands to convert_to_original_coordinates for one stored structure
+    label_map = LabelMap(mask.shape)
+    label_map.add(mask)
+    entries = {}
+    for key in args.formats:
+        exporter = EXPORTERS[key]
+        output_path = exporter.output_path(os.path.join(work_dir, 'export'), key)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        entry, _ = measure(lambda: exporter.export(label_map.data, output_path, metadata), 1, args.memory)
+        entry['bytes'] = directory_bytes(output_path)
+        entries[key] = entry
+    return entries
+
+
+def run_size(name, args):
+    shape = PHANTOM_SIZES[name]
+    print(f"{name} {shape}")
+    calculator = Calculator()
+    start_time = time.perf_counter()
+    volume, paths = make_phantom(shape, seed=args.seed)
+    result = {'shape': list(shape), 'phantom_seconds': round(time.perf_counter() - start_time, 4)}
+    seed = vessel_seed(paths)
+
+    result['threshold'], mask = bench_threshold(calculator, volume, args)
+    print(f"  threshold {result['threshold']['seconds']:.3f}s")
+    result['brush'] = bench_brush(calculator, volume, seed, args)
+    result['grow'] = bench_grow(calculator, volume, seed, args)
+    print(f"  grow {result['grow']['seconds']:.3f}s, {result['grow']['voxels']} voxels")
+
+    metadata = {'pixel_spacing': (0.5, 0.5, 0.625), 'image_position_patient': (-125, -125, 0),
+                'image_orientation': (1, 0, 0, 0, 1, 0), 'slice_thickness': 0.625}
+    with tempfile.TemporaryDirectory(dir=args.work_dir) as work_dir:
+        if not args.skip_dicom:
+            result['dicom_read'] = bench_dicom_read(volume, work_dir, args)
+            print(f"  dicom read {result['dicom_read']['seconds']:.3f}s")
+        result['export'] = bench_export(mask, metadata, work_dir, args)
+        print("  export " + ", ".join(f"{key} {entry['seconds']:.3f}s" for key, entry in result['export'].items()))
+    return result
+
+
+def environment():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=root, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'simpleitk': sitk.Version_VersionString(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def flatten_seconds(results, prefix=''):
+    # 'small.threshold.seconds': 1.2 style keys of every timing in a results file
+    flat = {}
+    if isinstance(results, dict):
+        for key, value in results.items():
+            if key.endswith('seconds') and isinstance(value, (int, float)):
+                flat[prefix + key] = value
+            else:
+                flat.update(flatten_seconds(value, f"{prefix}{key}."))
+    elif isinstance(results, list):
+        for entry in results:
+            label = entry.get('size', '') if isinstance(entry, dict) else ''
+            flat.update(flatten_seconds(entry, f"{prefix}{label}."))
+    return flat
+
+
+def compare(previous_path, results):
+    with open(previous_path) as f:
+        previous = flatten_seconds(json.load(f)['results'])
+    current = flatten_seconds(results)
+    print(f"\n{'timing':<55} {'before':>9} {'after':>9} {'ratio':>7}")
+    for key in sorted(set(previous) & set(current)):
+        before, after = previous[key], current[key]
+        ratio = f"{after / before:.2f}" if before else '-'
+        print(f"{key:<55} {before:>9.4f} {after:>9.4f} {ratio:>7}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the segmentation steps on synthetic CTA phantoms.")
+    parser.add_argument('--sizes', nargs='+', choices=list(PHANTOM_SIZES), default=list(PHANTOM_SIZES))
+    parser.add_argument('--formats', nargs='+', choices=list(EXPORTERS), default=list(EXPORTERS))
+    parser.add_argument('--threads', type=int, default=1, help="max_workers of confrim_threshold")
+    parser.add_argument('--io-workers', type=int, default=None, help="threads of the DICOM loader")
+    parser.add_argument('--repeats', type=int, default=5, help="runs of the brush and grow timings, the best is kept")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help="skip the tracemalloc runs")
+    parser.add_argument('--skip-dicom', action='store_true', help="skip writing and reading the DICOM series")
+    parser.add_argument('--work-dir', default=None, help="folder for the temporary DICOM and export files")
+    parser.add_argument('-o', '--output', default=None, help="results JSON, phantom_<date>_<time>.json by default")
+    parser.add_argument('--compare', default=None, help="earlier results JSON to print ratios against")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = {name: run_size(name, args) for name in args.sizes}
+    output = args.output or f"phantom_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    with open(output, 'w') as f:
+        json.dump({'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'environment': environment(), 'arguments': vars(args),
+                   'max_rss_mb': round(max_rss_mb(), 1), 'results': results}, f, indent=2)
+    print(f"Results saved in: {output}")
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import numpy as np
+
+# Sizes of the benchmark suite in viewer indexing [column, row, slice]
+PHANTOM_SIZES = {
+    'small': (256, 256, 256),
+    'medium': (512, 512, 300),
+    'large': (512, 512, 1000),
+}
+
+AIR, TISSUE, BONE = -1000, 40, 900
+VESSEL_HU = (300, 500)
+
+
+def vessel_paths(shape, vessels, rng):
+    # Tubes meandering along z inside the body, each over its own z range with its own radius and contrast
+    nx, ny, nz = shape
+    z = np.arange(nz)
+    paths = []
+    for _ in range(vessels):
+        angle, distance = rng.uniform(0, 2 * np.pi), rng.uniform(0, 0.6)
+        base_x = nx / 2 + distance * 0.45 * nx * np.cos(angle)
+        base_y = ny / 2 + distance * 0.35 * ny * np.sin(angle)
+        amplitude = rng.uniform(0.02, 0.08) * min(nx, ny)
+        period = rng.uniform(0.5, 2.0) * nz
+        phase = rng.uniform(0, 2 * np.pi)
+        start = int(rng.integers(0, nz // 4 + 1))
+        stop = int(rng.integers(3 * nz // 4, nz + 1))
+        paths.append({
+            'x': base_x + amplitude * np.sin(2 * np.pi * z / period + phase),
+            'y': base_y + amplitude * np.cos(2 * np.pi * z / period + phase),
+            'radius': rng.uniform(1.5, max(2.0, 0.025 * min(nx, ny))),
+            'hu': rng.uniform(*VESSEL_HU),
+            'z': (start, stop),
+        })
+    return paths
+
+
+def make_phantom(shape, vessels=12, noise=20.0, seed=0):
+    # CTA-like volume in HU: air around an elliptic body of soft tissue, a bone column and contrast-filled
+    # vessels, plus gaussian noise. Built slice by slice so the largest size only needs the int16 volume.
+    rng = np.random.default_rng(seed)
+    nx, ny, nz = shape
+    x = np.arange(nx, dtype=np.float32)[:, np.newaxis]
+    y = np.arange(ny, dtype=np.float32)[np.newaxis, :]
+    body = ((x - nx / 2) / (0.45 * nx)) ** 2 + ((y - ny / 2) / (0.35 * ny)) ** 2 <= 1
+    spine = (x - nx / 2) ** 2 + (y - 0.75 * ny) ** 2 <= (0.05 * min(nx, ny)) ** 2
+    background = np.where(body, TISSUE, AIR).astype(np.float32)
+    background[spine] = BONE
+    paths = vessel_paths(shape, vessels, rng)
+
+    volume = np.empty(shape, dtype=np.int16)
+    image_slice = np.empty((nx, ny), dtype=np.float32)
+    for k in range(nz):
+        image_slice[:] = background
+        for path in paths:
+            if not path['z'][0] <= k < path['z'][1]:
+                continue
+            cx, cy, radius = path['x'][k], path['y'][k], path['radius']
+            rows = slice(max(int(cx - radius), 0), min(int(cx + radius) + 2, nx))
+            columns = slice(max(int(cy - radius), 0), min(int(cy + radius) + 2, ny))
+            disc = (x[rows] - cx) ** 2 + (y[:, columns] - cy) ** 2 <= radius ** 2
+            image_slice[rows, columns][disc] = path['hu']
+        image_slice += noise * rng.standard_normal((nx, ny), dtype=np.float32)
+        np.rint(image_slice, out=image_slice)
+        volume[:, :, k] = image_slice
+    return volume, paths
+
+
+def vessel_seed(paths):
+    # Centre voxel of the longest vessel half way along it, inside the tube whatever its radius
+    path = max(paths, key=lambda path: (path['z'][1] - path['z'][0]) * path['radius'])
+    k = (path['z'][0] + path['z'][1]) // 2
+    return int(round(path['x'][k])), int(round(path['y'][k])), k
@@ -0,0 +1,97 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROBE = os.path.join(ROOT, 'benchmarks', 'startup_probe.py')
+SPEC = os.path.join(ROOT, 'CT_reader6.spec')
+
+# Time from launching the app to its main window being shown, from source and from a PyInstaller build.
+# startup_probe makes the app quit by itself once shown and report the heavy modules it had loaded by then,
+# VTK and SimpleITK should only appear once the 3D view or an export is used.
+SOURCE_COMMAND = [sys.executable, '-c', "import runpy, sys; sys.path.insert(0, 'benchmarks'); import startup_probe; "
+                                        "runpy.run_path('CT_reader6.py', run_name='__main__')"]
+
+
+def build_frozen(work_dir):
+    # CT_reader6.spec with the probe added as a runtime hook, built outside dist/ so the release build is untouched
+    with open(SPEC) as f:
+        spec = f.read()
+    for old, new in (("['CT_reader6.py']", repr([os.path.join(ROOT, 'CT_reader6.py')])),
+                     ('runtime_hooks=[]', f"runtime_hooks={[PROBE]!r}")):
+        if old not in spec:
+            raise RuntimeError(f"{SPEC} has no {old}, add the probe to its runtime_hooks by hand")
+        spec = spec.replace(old, new)
+    spec_path = os.path.join(work_dir, 'CT_reader6_probe.spec')
+    with open(spec_path, 'w') as f:
+        f.write(spec)
+    subprocess.run([sys.executable, '-m', 'PyInstaller', '--noconfirm', '--distpath', os.path.join(work_dir, 'dist'),
+                    '--workpath', os.path.join(work_dir, 'build'), spec_path], cwd=ROOT, check=True)
+    return os.path.join(work_dir, 'dist', 'CT_reader6', 'CT_reader6.exe' if sys.platform == 'win32' else 'CT_reader6')
+
+
+def time_startup(command, repeats, offscreen):
+    env = dict(os.environ)
+    if offscreen:
+        env['QT_QPA_PLATFORM'] = 'offscreen'
+    seconds = []
+    report = ''
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        completed = subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True, timeout=300)
+        seconds.append(time.perf_counter() - start_time)
+        shown = [line for line in completed.stdout.splitlines() if line.startswith('Window shown')]
+        if completed.returncode != 0 or not shown:
+            raise RuntimeError(f"{' '.join(command)} did not show its window:\n{completed.stderr[-2000:]}")
+        report = shown[-1]
+    return {'best': round(min(seconds), 3), 'median': round(statistics.median(seconds), 3),
+            'heavy_modules': report.split(': ', 1)[1]}
+
+
+def time_import(module, repeats):
+    # Fresh interpreter importing one module, which must not pull in Qt or VTK for headless use
+    code = (f"import sys, time; start = time.perf_counter(); import {module}; "
+            f"print(time.perf_counter() - start, ','.join(sorted({{n.split('.')[0] for n in sys.modules}} & {{'PyQt5', 'vtk', 'vtkmodules', 'SimpleITK', 'skimage'}})) or 'none')")
+    seconds = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True).stdout.split()
+        seconds.append(float(output[0]))
+    return {'best': round(min(seconds), 3), 'median': round(statistics.median(seconds), 3), 'heavy_modules': output[1]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Start-up time of CT_reader6 from source and from the frozen build.")
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--frozen', default=None, help="executable of a build made with startup_probe as a runtime hook")
+    parser.add_argument('--build-frozen', action='store_true', help="build one from CT_reader6.spec with PyInstaller first")
+    parser.add_argument('--offscreen', action='store_true', help="no display needed, Qt renders offscreen")
+    parser.add_argument('-o', '--output', default=None, help="also save the results as JSON")
+    args = parser.parse_args()
+
+    results = {
+        'import Calculator': time_import('Calculator', args.repeats),
+        'import CT_reader6': time_import('CT_reader6', args.repeats),
+        'source': time_startup(SOURCE_COMMAND, args.repeats, args.offscreen),
+    }
+    with tempfile.TemporaryDirectory() as work_dir:
+        frozen = build_frozen(work_dir) if args.build_frozen else args.frozen
+        if frozen:
+            results['frozen'] = time_startup([frozen], args.repeats, args.offscreen)
+        else:
+            print("Frozen build not timed, use --build-frozen or --frozen")
+
+    print(f"{'':<20} {'best (s)':>9} {'median (s)':>11}  heavy modules loaded")
+    for name, result in results.items():
+        print(f"{name:<20} {result['best']:>9.3f} {result['median']:>11.3f}  {result['heavy_modules']}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+import sys
+
+from PyQt5 import QtCore
+from PyQt5.QtWidgets import QApplication
+
+# Imported before CT_reader6 runs, or as a PyInstaller runtime hook in the frozen build. Once the event loop has
+# shown the main window it prints the heavy modules loaded by then and quits the app.
+
+HEAVY_MODULES = {'vtk', 'vtkmodules', 'SimpleITK', 'skimage'}
+
+
+def report_and_quit():
+    heavy = sorted({name.split('.')[0] for name in sys.modules} & HEAVY_MODULES)
+    print(f"Window shown, heavy modules: {','.join(heavy) or 'none'}", flush=True)
+    QApplication.instance().quit()
+
+
+application_exec = QApplication.exec_
+
+
+def probed_exec():
+    QtCore.QTimer.singleShot(0, report_and_quit)
+    return application_exec()
+
+
+# exec_ is static in PyQt5, app.exec_() and QApplication.exec_() both end up here
+QApplication.exec_ = staticmethod(probed_exec)
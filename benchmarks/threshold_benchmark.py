@@ -0,0 +1,88 @@
+import os
+import sys
+import time
+import numpy as np
+from scipy import ndimage
+from skimage.morphology import disk
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Calculator import Calculator
+
+
+# Per-slice stages of confrim_threshold before the batched 3D morphology
+def loop_threshold(cropped_data, lower_thresh, higher_thresh):
+    threshold_condition = (cropped_data >= lower_thresh) & (cropped_data <= higher_thresh)
+    return np.where(threshold_condition, 1, 0)
+
+
+def loop_open_close(data_threshold):
+    structure = np.ones((3, 3), dtype=bool)
+    processed_slices = np.empty_like(data_threshold)
+    for z in range(data_threshold.shape[2]):
+        opened_image = ndimage.binary_opening(data_threshold[:, :, z], structure=structure, iterations=1)
+        closed_image = ndimage.binary_closing(opened_image, structure=structure, iterations=1)
+        processed_slices[:, :, z] = closed_image.astype(np.uint8)
+    return processed_slices
+
+
+def loop_dilate_erode(filtered_data):
+    structure = disk(3)
+    new_slices = []
+    for z in range(filtered_data.shape[2]):
+        dilated_image = ndimage.binary_dilation(filtered_data[:, :, z], structure=structure, iterations=1)
+        eroded_image = ndimage.binary_erosion(dilated_image, structure=structure, iterations=1)
+        new_slices.append(eroded_image.astype(np.uint8))
+    return np.stack(new_slices, axis=2)
+
+
+def make_roi(shape, seed=0):
+    # Noisy background with a few bright tubes running along z
+    rng = np.random.default_rng(seed)
+    roi = rng.normal(0, 150, size=shape).astype(np.int16)
+    x, y = np.ogrid[:shape[0], :shape[1]]
+    for _ in range(6):
+        cx, cy, radius = rng.integers(10, shape[0] - 10), rng.integers(10, shape[1] - 10), rng.integers(2, 6)
+        roi[(x - cx) ** 2 + (y - cy) ** 2 <= radius ** 2] += 450
+    return roi
+
+
+def timed(func, *args):
+    start_time = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start_time
+
+
+def main():
+    calculator = Calculator()
+    shape = tuple(int(v) for v in sys.argv[1:4]) if len(sys.argv) > 3 else (256, 256, 200)
+    roi = make_roi(shape)
+    lower_thresh, higher_thresh = 300, 700
+
+    loop_threshold_data, loop_step1 = timed(loop_threshold, roi, lower_thresh, higher_thresh)
+    data_threshold, step1 = timed(calculator.threshold_roi, roi, lower_thresh, higher_thresh)
+    assert np.array_equal(loop_threshold_data, data_threshold)
+
+    loop_processed, loop_step2 = timed(loop_open_close, loop_threshold_data)
+    processed, step2 = timed(calculator.open_close, data_threshold)
+    assert np.array_equal(loop_processed, processed)
+
+    filtered, step3 = timed(calculator.largest_components, processed, 3)
+
+    loop_eroded, loop_step4 = timed(loop_dilate_erode, filtered)
+    eroded, step4 = timed(calculator.dilate_erode, filtered)
+    assert np.array_equal(loop_eroded, eroded)
+
+    _, step5 = timed(calculator.smooth, eroded)
+
+    print(f"ROI {shape}, outputs identical to the per-slice pipeline")
+    print(f"{'stage':<28} {'per-slice (s)':>14} {'batched (s)':>12} {'speedup':>9}")
+    for name, before, after in (("1 thresholding", loop_step1, step1),
+                                ("2 opening and closing", loop_step2, step2),
+                                ("3 connected components", step3, step3),
+                                ("4 dilating and eroding", loop_step4, step4),
+                                ("5 gaussian", step5, step5)):
+        print(f"{name:<28} {before:>14.3f} {after:>12.3f} {before / after:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()